@@ -41,19 +41,31 @@ Este ejemplo esta basado en agent_memory_redis.py del repositorio
 de Azure Samples, adaptado para usar LangChain.
 """
 
-import json
+import functools
+import hashlib
 import logging
 import os
 import random
+import re
 import time
+import unicodedata
 import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
+import orjson
 import redis
+from redis.commands.search.aggregation import AggregateRequest, Desc
+from redis.commands.search.field import NumericField, TagField, TextField
+from redis.commands.search.index_definition import IndexDefinition, IndexType
+from redis.commands.search.query import Query
 from dotenv import load_dotenv
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import Runnable
 from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, Field
 
 # -- Logging --
 logging.basicConfig(level=logging.WARNING, format="%(message)s")
@@ -74,20 +86,131 @@ LLM_TEMPERATURE = float(os.getenv("DEFAULT_LLM_TEMPERATURE", "0.7"))
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 
 
+# -- Tokenizacion de keywords --
+
+
+def _build_accent_table() -> dict[int, str]:
+    """Tabla para quitar acentos con str.translate (ej: "París" -> "Paris").
+
+    Se construye una sola vez con unicodedata sobre los rangos Latin-1 y
+    Latin Extended-A, en lugar de normalizar caracter por caracter en cada
+    consulta.
+    """
+    table = {}
+    for code in range(0xC0, 0x180):
+        char = chr(code)
+        base = "".join(
+            c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c)
+        )
+        if base != char and base.isascii():
+            table[code] = base
+    return table
+
+
+_ACCENT_TABLE = _build_accent_table()
+
+
+def _strip_accents(text: str) -> str:
+    """Quita los acentos de un texto.
+
+    La tabla cubre los casos comunes; si despues queda algun caracter no
+    ASCII (otros alfabetos, ligaduras, letras fuera de la tabla) se aplica
+    NFKD sobre el texto completo, igual que antes de tener la tabla.
+    """
+    text = text.translate(_ACCENT_TABLE)
+    if text.isascii():
+        return text
+    return "".join(
+        c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c)
+    )
+
+
+# Todo lo que no es letra o digito (en cualquier alfabeto) dentro de una palabra
+_NON_ALNUM_RE = re.compile(r"[\W_]+")
+
+# Stop words en espanol e ingles para filtrar de las queries de busqueda.
+# RediSearch usa AND por defecto, asi que enviar palabras comunes
+# como "es", "mi", "que" causa que la busqueda falle cuando esos
+# terminos no estan en el contenido indexado. Cada idioma tiene su propio
+# conjunto; la union elimina las palabras compartidas ("a", "so").
+_STOP_WORDS_ES = frozenset(
+    {
+        "a", "al", "algo", "como", "con", "cual", "de", "del", "el",
+        "en", "es", "eso", "esta", "esto", "fue", "ha", "hay", "la",
+        "las", "le", "lo", "los", "me", "mi", "muy", "no", "nos", "o",
+        "para", "pero", "por", "que", "se", "si", "sin", "so", "son",
+        "su", "te", "tu", "un", "una", "uno", "y", "ya",
+    }
+)
+_STOP_WORDS_EN = frozenset(
+    {
+        "a", "an", "and", "are", "as", "at", "be", "but", "by", "do",
+        "for", "from", "has", "have", "he", "her", "his", "how", "i",
+        "if", "in", "is", "it", "its", "my", "not", "of", "on", "or",
+        "our", "she", "so", "that", "the", "their", "them", "they",
+        "this", "to", "was", "we", "what", "when", "which", "who",
+        "will", "with", "you", "your",
+    }
+)
+_STOP_WORDS = _STOP_WORDS_ES | _STOP_WORDS_EN
+
+
 # -- Herramienta simulada (datos ficticios) --
 
 
+_WEATHER_CONDITIONS = ("soleado", "nublado", "lluvioso", "tormentoso")
+
+
 def get_weather(city: str) -> str:
     """Devuelve datos del clima simulados para una ciudad."""
-    conditions = ["soleado", "nublado", "lluvioso", "tormentoso"]
     temp = random.randint(10, 30)
-    condition = conditions[random.randint(0, 3)]
+    condition = random.choice(_WEATHER_CONDITIONS)
     return f"El clima en {city} esta {condition} con una temperatura maxima de {temp} C."
 
 
 # -- Almacen de memoria en Redis con RediSearch --
 
 
+# Pools de conexiones compartidos, uno por URL de Redis. Crear un cliente con
+# redis.from_url() en cada RedisMemoryStore abriria un pool nuevo por usuario;
+# reutilizar el pool evita reconectar (TCP) en cada instancia. redis-py usa
+# automaticamente el parser en C de hiredis si el paquete esta instalado.
+_POOLS: dict[str, redis.ConnectionPool] = {}
+
+
+def _get_pool(redis_url: str) -> redis.ConnectionPool:
+    """Devuelve el pool de conexiones compartido para una URL de Redis."""
+    pool = _POOLS.get(redis_url)
+    if pool is None:
+        pool = redis.ConnectionPool.from_url(
+            redis_url, decode_responses=True, max_connections=32
+        )
+        _POOLS[redis_url] = pool
+    return pool
+
+
+# Guarda una memoria de forma atomica: registra el hash en el SET de
+# deduplicacion y, solo si es nuevo, escribe el Hash y su ID en la lista de
+# recientes. Si la escritura no llega a ejecutarse, el hash tampoco queda
+# registrado (un SADD sin HSET haria que el hecho se omita para siempre).
+# KEYS: memdedup:{user}, mems:{user}, memory:{id}
+# ARGV: content_hash, content, content_kw, user_id, timestamp, RECENT_IDS_MAX
+_SAVE_MEMORY_LUA = """
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[3],
+    'content', ARGV[2],
+    'content_hash', ARGV[1],
+    'content_kw', ARGV[3],
+    'user_id', ARGV[4],
+    'timestamp', ARGV[5])
+redis.call('LPUSH', KEYS[2], KEYS[3])
+redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[6]) - 1)
+return 1
+"""
+
+
 class RedisMemoryStore:
     """Almacena hechos (memorias) en Redis y los busca con RediSearch.
 
@@ -105,196 +228,416 @@ class RedisMemoryStore:
 
     INDEX_NAME = "idx:memories"
     PREFIX = "memory:"
+    # Segundos que una busqueda queda cacheada en Redis
+    SEARCH_CACHE_TTL = 300
+    # Candidatos que se piden a FT.SEARCH antes del re-ranking local
+    RERANK_CANDIDATES = 10
+    # Tope de resultados de get_all_memories: sin MAX, SORTBY de
+    # FT.AGGREGATE devuelve solo los primeros 10
+    ALL_MEMORIES_MAX = 10000
+    # Maximo de IDs que se conservan en la lista de memorias recientes
+    RECENT_IDS_MAX = 500
+    # Segundos durante los que se confia en que el usuario no tiene memorias
+    NO_MEMORIES_RECHECK = 30
+    # Maximo de hashes de hechos ya guardados que se recuerdan en memoria
+    SEEN_HASHES_MAX = 4096
 
     def __init__(self, redis_url: str, user_id: str) -> None:
-        self.r = redis.from_url(redis_url, decode_responses=True)
+        self.r = redis.Redis(connection_pool=_get_pool(redis_url))
         self.user_id = user_id
-        # Escapar guiones en el user_id para queries de tags de RediSearch.
-        # Los guiones son caracteres especiales en la sintaxis de tags.
-        self._escaped_user_id = user_id.replace("-", "\\-")
+        # Escapar el user_id para queries de tags de RediSearch.
+        # Los guiones (y otros simbolos) son especiales en la sintaxis de tags.
+        self._escaped_user_id = self._escape_query(user_id)
+        # SET con los hashes del contenido normalizado de cada memoria del
+        # usuario. Permite deduplicar en O(1) sin recorrer el indice.
+        self._dedup_key = f"memdedup:{user_id}"
+        # Cache de resultados de search_memories. Cada entrada vive en
+        # memcache:{user_id}:{hash} y sus claves se registran en un SET
+        # para poder invalidarlas todas cuando cambian las memorias.
+        self._cache_prefix = f"memcache:{user_id}:"
+        self._cache_keys_key = f"memcache_keys:{user_id}"
+        # LIST con los IDs de las memorias del usuario, la mas reciente
+        # primero. Sirve para listar memorias recientes sin FT.SEARCH.
+        self._ids_key = f"mems:{user_id}"
+        # Si el usuario tiene memorias guardadas. Solo se recuerda el "si":
+        # un "no" se vuelve a comprobar pasados NO_MEMORIES_RECHECK segundos,
+        # porque otra instancia u otro proceso puede guardar memorias del
+        # mismo usuario. Para un usuario nuevo evita buscar en cada turno.
+        self._has_memories = False
+        self._no_memories_until = 0.0
+        self._save_script = self.r.register_script(_SAVE_MEMORY_LUA)
+        # Hashes de hechos que esta instancia ya guardo. Un hecho repetido
+        # (el LLM suele reextraer lo mismo en turnos seguidos) se descarta
+        # sin ir a Redis. Se limita a SEEN_HASHES_MAX entradas (FIFO) y se
+        # vacia en clear_memories, junto con memdedup:{user_id}.
+        self._seen_hashes: set[str] = set()
+        self._seen_order: deque[str] = deque()
         self._ensure_index()
 
     def _ensure_index(self) -> None:
-        """Crea el indice RediSearch si no existe."""
+        """Crea el indice RediSearch si no existe.
+
+        Si existe un indice de una version anterior al que le falta algun
+        campo del esquema actual, se elimina (sin borrar los Hashes) y se
+        vuelve a crear; RediSearch reindexa los documentos existentes.
+        """
         try:
-            self.r.ft(self.INDEX_NAME).info()
-            logger.info("[Redis] Indice '%s' ya existe", self.INDEX_NAME)
+            info = self.r.ft(self.INDEX_NAME).info()
+            attributes = info.get("attributes", [])
+            if all(
+                any(field in attr for attr in attributes)
+                for field in ("timestamp", "content_kw")
+            ):
+                logger.info("[Redis] Indice '%s' ya existe", self.INDEX_NAME)
+                return
+            logger.info("[Redis] Indice '%s' desactualizado, recreando", self.INDEX_NAME)
+            self.r.ft(self.INDEX_NAME).dropindex(delete_documents=False)
         except redis.ResponseError:
             # El indice no existe, crearlo
-            from redis.commands.search.field import TagField, TextField
-            from redis.commands.search.index_definition import (
-                IndexDefinition,
-                IndexType,
-            )
-
-            schema = (
-                TextField("content", weight=1.0),
-                TagField("user_id"),
-            )
-            definition = IndexDefinition(
-                prefix=[self.PREFIX],
-                index_type=IndexType.HASH,
-            )
-            self.r.ft(self.INDEX_NAME).create_index(
-                schema,
-                definition=definition,
-            )
-            logger.info("[Redis] Indice '%s' creado", self.INDEX_NAME)
+            pass
+
+        # SORTABLE solo en 'timestamp', el unico campo por el que se ordena.
+        schema = (
+            TextField("content", weight=1.0),
+            TextField("content_kw", no_stem=True),
+            TagField("user_id"),
+            NumericField("timestamp", sortable=True),
+        )
+        definition = IndexDefinition(
+            prefix=[self.PREFIX],
+            index_type=IndexType.HASH,
+        )
+        self.r.ft(self.INDEX_NAME).create_index(
+            schema,
+            definition=definition,
+        )
+        logger.info("[Redis] Indice '%s' creado", self.INDEX_NAME)
 
     def save_memory(self, content: str) -> str:
         """Guarda un hecho en Redis como un Hash.
 
         Antes de guardar, verifica si ya existe una memoria con contenido
-        identico para este usuario (deduplicacion).
+        identico para este usuario (deduplicacion). Devuelve el ID de la
+        memoria, o "" si era un duplicado.
         """
-        # Deduplicar: buscar si ya existe este hecho exacto
-        existing = self.get_all_memories()
-        normalized = content.strip().lower()
-        for mem in existing:
-            if mem.strip().lower() == normalized:
-                logger.info("[Redis] Memoria duplicada, omitida: '%s'", content)
-                return ""
-
-        memory_id = f"{self.PREFIX}{uuid.uuid4().hex[:12]}"
-        self.r.hset(
-            memory_id,
-            mapping={
-                "content": content,
-                "user_id": self.user_id,
-                "timestamp": str(int(time.time())),
-            },
-        )
-        logger.info("[Redis] Memoria guardada: '%s'", content)
-        return memory_id
-
-    # Stop words en espanol e ingles para filtrar de las queries de busqueda.
-    # RediSearch usa AND por defecto, asi que enviar palabras comunes
-    # como "es", "mi", "que" causa que la busqueda falle cuando esos
-    # terminos no estan en el contenido indexado.
-    _STOP_WORDS = frozenset(
-        {
-            # Espanol
-            "a", "al", "algo", "como", "con", "cual", "de", "del", "el",
-            "en", "es", "eso", "esta", "esto", "fue", "ha", "hay", "la",
-            "las", "le", "lo", "los", "me", "mi", "muy", "no", "nos", "o",
-            "para", "pero", "por", "que", "se", "si", "sin", "so", "son",
-            "su", "te", "tu", "un", "una", "uno", "y", "ya",
-            # Ingles
-            "a", "an", "and", "are", "as", "at", "be", "but", "by", "do",
-            "for", "from", "has", "have", "he", "her", "his", "how", "i",
-            "if", "in", "is", "it", "its", "my", "not", "of", "on", "or",
-            "our", "she", "so", "that", "the", "their", "them", "they",
-            "this", "to", "was", "we", "what", "when", "which", "who",
-            "will", "with", "you", "your",
-        }
-    )
+        return self.save_memories([content])[0]
+
+    def save_memories(self, contents: list[str]) -> list[str]:
+        """Guarda varios hechos en Redis en un solo round-trip.
+
+        Para no recorrer todas las memorias en cada escritura, se calcula un
+        hash del contenido normalizado y se registra en un SET por usuario.
+        Cada hecho se guarda con un script Lua (_SAVE_MEMORY_LUA) que hace el
+        SADD y, si el hash es nuevo, el HSET y el LPUSH de forma atomica;
+        todas las llamadas al script van en un pipeline. Los hechos que esta
+        instancia ya guardo (o repetidos en el lote) se descartan sin ir a
+        Redis. Devuelve un ID por hecho, "" para los duplicados.
+        """
+        timestamp = int(time.time())
+        hashes = [self._content_hash(content) for content in contents]
+        pending = []
+        batch = set()
+        pipe = self.r.pipeline(transaction=False)
+        for i, (content, content_hash) in enumerate(zip(contents, hashes)):
+            if content_hash in self._seen_hashes or content_hash in batch:
+                logger.info("[Redis] Memoria ya guardada, omitida: '%s'", content)
+                continue
+            batch.add(content_hash)
+            memory_id = f"{self.PREFIX}{uuid.uuid4().hex[:12]}"
+            self._save_script(
+                keys=[self._dedup_key, self._ids_key, memory_id],
+                args=[
+                    content_hash,
+                    content,
+                    " ".join(self._extract_keywords(content)),
+                    self.user_id,
+                    timestamp,
+                    self.RECENT_IDS_MAX,
+                ],
+                client=pipe,
+            )
+            pending.append((i, memory_id))
 
-    def _extract_keywords(self, text: str) -> list[str]:
-        """Extrae palabras clave de un texto, removiendo stop words y puntuacion."""
-        import unicodedata
+        memory_ids = [""] * len(contents)
+        if not pending:
+            return memory_ids
 
-        # Normalizar acentos para mejorar coincidencias
-        # (ej: "Paris" coincide con "París")
-        normalized = unicodedata.normalize("NFKD", text)
-        ascii_text = "".join(
-            c for c in normalized if not unicodedata.combining(c)
-        )
+        for (i, memory_id), is_new in zip(pending, pipe.execute()):
+            if is_new:
+                logger.info("[Redis] Memoria guardada: '%s'", contents[i])
+                memory_ids[i] = memory_id
+            else:
+                logger.info("[Redis] Memoria duplicada, omitida: '%s'", contents[i])
+        # Guardados ahora o ya presentes en memdedup: en ambos casos estan en Redis
+        self._mark_seen(batch)
+
+        if any(memory_ids):
+            self._has_memories = True
+            self._invalidate_search_cache()
+        return memory_ids
+
+    def _mark_seen(self, hashes: set[str]) -> None:
+        """Registra hashes como guardados, expulsando los mas antiguos si hay exceso."""
+        for content_hash in hashes:
+            self._seen_hashes.add(content_hash)
+            self._seen_order.append(content_hash)
+            if len(self._seen_order) > self.SEEN_HASHES_MAX:
+                self._seen_hashes.discard(self._seen_order.popleft())
 
-        # Extraer solo palabras alfanumericas
-        words = []
-        for word in ascii_text.split():
-            clean = "".join(c for c in word if c.isalnum())
-            if clean and clean.lower() not in self._STOP_WORDS and len(clean) > 1:
-                words.append(clean)
+    @staticmethod
+    def _content_hash(content: str) -> str:
+        """Hash del contenido normalizado, usado como clave de deduplicacion."""
+        normalized = content.strip().lower()
+        return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
 
-        return words
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _extract_keywords(text: str) -> tuple[str, ...]:
+        """Extrae palabras clave de un texto, removiendo stop words y puntuacion.
+
+        Normaliza acentos para mejorar coincidencias (ej: "Paris" coincide con
+        "París") y cachea el resultado, ya que la misma consulta suele
+        repetirse entre turnos. Devuelve una tupla para que el valor cacheado
+        no pueda modificarse.
+        """
+        # Cada palabra (separada por espacios) conserva solo letras y digitos,
+        # asi "don't" queda como "dont" y no se parte en fragmentos
+        words = (_NON_ALNUM_RE.sub("", word) for word in _strip_accents(text).split())
+        return tuple(w for w in words if len(w) > 1 and w.casefold() not in _STOP_WORDS)
 
-    def search_memories(self, query: str, max_results: int = 5) -> list[str]:
+    def search_memories(self, query: str, max_results: int = 3) -> list[str]:
         """Busca memorias relevantes usando RediSearch (texto completo).
 
         Extrae palabras clave de la consulta del usuario, las une con OR (|)
         y filtra por user_id. Si no hay palabras clave significativas,
         devuelve todas las memorias del usuario como fallback.
 
-        Usa FT.SEARCH con BM25 sobre el campo 'content'.
+        Usa FT.SEARCH con BM25 sobre el campo 'content' y re-ordena los
+        candidatos localmente por Jaccard de keywords (ver _rerank). Los resultados se
+        cachean en Redis durante SEARCH_CACHE_TTL segundos, de modo que una
+        pregunta repetida se resuelve con un GET en lugar de otro FT.SEARCH.
+        Si el usuario aun no tiene memorias, devuelve [] sin consultar nada.
         """
+        if not self._has_memories and time.monotonic() >= self._no_memories_until:
+            self._has_memories = self._user_has_memories()
+            if not self._has_memories:
+                self._no_memories_until = time.monotonic() + self.NO_MEMORIES_RECHECK
+        if not self._has_memories:
+            logger.info("[Redis] Usuario sin memorias, busqueda omitida")
+            return []
+
+        cache_key = self._search_cache_key(query, max_results)
+        cached = self.r.get(cache_key)
+        if cached is not None:
+            logger.info("[Redis] Cache HIT para '%s'", query[:40])
+            return orjson.loads(cached)
+
+        logger.info("[Redis] Cache MISS para '%s'", query[:40])
         try:
-            from redis.commands.search.query import Query
+            memories = self._search_memories_uncached(query, max_results)
+        except redis.ResponseError as e:
+            logger.info("[Redis] Error en busqueda: %s", e)
+            return []
 
-            keywords = self._extract_keywords(query)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.setex(cache_key, self.SEARCH_CACHE_TTL, orjson.dumps(memories))
+        pipe.sadd(self._cache_keys_key, cache_key)
+        # El SET de claves vence junto con la ultima entrada cacheada; si no,
+        # en usuarios que solo leen acumularia claves ya expiradas
+        pipe.expire(self._cache_keys_key, self.SEARCH_CACHE_TTL)
+        pipe.execute()
+        return memories
+
+    def _user_has_memories(self) -> bool:
+        """Indica si el usuario tiene alguna memoria en el indice.
+
+        Usa FT.SEARCH con LIMIT 0 0 (solo el total, sin documentos), asi
+        tambien cuenta las memorias guardadas antes de que existieran
+        memdedup:{user_id} y mems:{user_id}.
+        """
+        q = (
+            Query(f"@user_id:{{{self._escaped_user_id}}}")
+            .no_content()
+            .paging(0, 0)
+            .dialect(2)
+        )
+        try:
+            return self.r.ft(self.INDEX_NAME).search(q).total > 0
+        except redis.ResponseError:
+            # Si no se puede contar, no omitir la busqueda
+            return True
 
-            if not keywords:
-                # Sin palabras clave, devolver todas las memorias del usuario
-                logger.info("[Redis] Sin palabras clave, devolviendo todas las memorias")
-                return self.get_all_memories()[:max_results]
+    def _search_memories_uncached(self, query: str, max_results: int) -> list[str]:
+        """Ejecuta la busqueda en RediSearch sin pasar por la cache."""
+        keywords = self._extract_keywords(query)
 
-            # Unir con OR (|) para que cualquier termino coincida
-            escaped_terms = [self._escape_query(kw) for kw in keywords]
-            text_query = " | ".join(escaped_terms)
+        if not keywords:
+            # Sin palabras clave, devolver todas las memorias del usuario
+            logger.info("[Redis] Sin palabras clave, devolviendo todas las memorias")
+            return self.get_recent_memories(max_results)
 
-            full_query = f"@user_id:{{{self._escaped_user_id}}} ({text_query})"
+        # Unir con OR (|) para que cualquier termino coincida
+        escaped_terms = [self._escape_query(kw) for kw in keywords]
+        text_query = " | ".join(escaped_terms)
 
-            q = (
-                Query(full_query)
-                .return_fields("content")
-                .paging(0, max_results)
-            )
-            results = self.r.ft(self.INDEX_NAME).search(q)
+        full_query = f"@user_id:{{{self._escaped_user_id}}} ({text_query})"
 
-            memories = [doc.content for doc in results.docs]
-            logger.info(
-                "[Redis] Busqueda '%s' (keywords: %s) -> %d memoria(s)",
-                query[:40],
-                ", ".join(keywords[:5]),
-                len(memories),
-            )
-            return memories
-        except redis.ResponseError as e:
-            logger.info("[Redis] Error en busqueda: %s", e)
+        q = (
+            Query(full_query)
+            .return_fields("content", "content_kw", "content_hash")
+            .paging(0, max(max_results, self.RERANK_CANDIDATES))
+            .dialect(2)
+        )
+        results = self.r.ft(self.INDEX_NAME).search(q)
+
+        memories = self._rerank(keywords, results.docs, max_results)
+        logger.info(
+            "[Redis] Busqueda '%s' (keywords: %s) -> %d de %d memoria(s)",
+            query[:40],
+            ", ".join(keywords[:5]),
+            len(memories),
+            len(results.docs),
+        )
+        return memories
+
+    def _rerank(self, keywords: tuple[str, ...], docs: list, max_results: int) -> list[str]:
+        """Reordena los resultados de FT.SEARCH por similitud de Jaccard.
+
+        Compara las keywords de la consulta con las keywords precalculadas
+        de cada memoria ('content_kw', guardado al escribir) y descarta las
+        memorias con el mismo hash de contenido. Asi se inyectan en el prompt
+        solo las memorias mas relevantes y sin duplicados, con menos tokens.
+        """
+        query_kw = {kw.lower() for kw in keywords}
+        scored = []
+        seen = set()
+        for doc in docs:
+            content_hash = getattr(doc, "content_hash", None) or self._content_hash(doc.content)
+            if content_hash in seen:
+                continue
+            seen.add(content_hash)
+
+            # Las memorias anteriores a 'content_kw' se tokenizan al vuelo
+            content_kw = getattr(doc, "content_kw", None)
+            if content_kw is None:
+                content_kw = " ".join(self._extract_keywords(doc.content))
+            mem_kw = {kw.lower() for kw in content_kw.split()}
+
+            union = query_kw | mem_kw
+            score = len(query_kw & mem_kw) / len(union) if union else 0.0
+            scored.append((score, doc.content))
+
+        # sorted es estable: a igual score se conserva el orden BM25
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [content for _, content in scored[:max_results]]
+
+    def _search_cache_key(self, query: str, max_results: int) -> str:
+        """Clave de cache para una consulta (normalizada) y un limite de resultados."""
+        normalized = " ".join(query.lower().split())
+        query_hash = hashlib.sha256(f"{max_results}:{normalized}".encode()).hexdigest()[:16]
+        return f"{self._cache_prefix}{query_hash}"
+
+    def _invalidate_search_cache(self) -> None:
+        """Descarta las busquedas cacheadas del usuario (tras escribir o borrar)."""
+        keys = self.r.smembers(self._cache_keys_key)
+        if keys:
+            self.r.delete(*keys, self._cache_keys_key)
+
+    def get_recent_memories(self, max_results: int) -> list[str]:
+        """Devuelve las memorias mas recientes del usuario (hasta max_results).
+
+        No usa FT.SEARCH: lee los IDs de la lista mems:{user_id} con LRANGE
+        y el contenido de cada uno con HGET en un pipeline. Para este patron
+        (solo filtrar por usuario, sin texto) una estructura nativa de Redis
+        evita el parseo de la consulta y el scoring de RediSearch.
+        """
+        memory_ids = self.r.lrange(self._ids_key, 0, max_results - 1)
+        if not memory_ids:
             return []
 
+        pipe = self.r.pipeline(transaction=False)
+        for memory_id in memory_ids:
+            pipe.hget(memory_id, "content")
+        return [content for content in pipe.execute() if content is not None]
+
     def get_all_memories(self) -> list[str]:
-        """Devuelve todas las memorias del usuario."""
-        try:
-            from redis.commands.search.query import Query
+        """Devuelve todas las memorias del usuario, de la mas reciente a la mas antigua.
 
-            q = (
-                Query(f"@user_id:{{{self._escaped_user_id}}}")
-                .return_fields("content", "timestamp")
-                .paging(0, 100)
+        Usa FT.AGGREGATE con un cursor que lee los resultados en bloques de
+        100, de modo que el servidor no serializa todas las memorias en una
+        sola respuesta. SORTBY lleva un MAX explicito (ALL_MEMORIES_MAX),
+        porque sin el RediSearch corta el orden en 10 resultados.
+        """
+        try:
+            req = (
+                AggregateRequest(f"@user_id:{{{self._escaped_user_id}}}")
+                .load("@content", "@timestamp")
+                .sort_by(Desc("@timestamp"), max=self.ALL_MEMORIES_MAX)
+                .cursor(count=100)
+                .dialect(2)
             )
-            results = self.r.ft(self.INDEX_NAME).search(q)
-            return [doc.content for doc in results.docs]
+            memories = []
+            result = self.r.ft(self.INDEX_NAME).aggregate(req)
+            while True:
+                for row in result.rows:
+                    fields = dict(zip(row[::2], row[1::2]))
+                    memories.append(fields["content"])
+                if not result.cursor or result.cursor.cid == 0:
+                    return memories
+                result = self.r.ft(self.INDEX_NAME).aggregate(result.cursor)
         except redis.ResponseError:
             return []
 
     def clear_memories(self) -> int:
-        """Elimina todas las memorias del usuario."""
-        memories = self.get_all_memories()
-        count = 0
-        for key in self.r.scan_iter(f"{self.PREFIX}*"):
-            if self.r.hget(key, "user_id") == self.user_id:
-                self.r.delete(key)
-                count += 1
+        """Elimina todas las memorias del usuario.
+
+        Obtiene solo los IDs de las memorias del usuario con FT.SEARCH
+        (NOCONTENT, el filtro por user_id se resuelve en el servidor) y las
+        borra con UNLINK en un unico pipeline, en lugar de hacer un HGET y un
+        DEL por cada clave. UNLINK libera la memoria en segundo plano.
+        """
+        q = (
+            Query(f"@user_id:{{{self._escaped_user_id}}}")
+            .no_content()
+            .paging(0, 10000)
+            .dialect(2)
+        )
+        keys = [doc.id for doc in self.r.ft(self.INDEX_NAME).search(q).docs]
+
+        pipe = self.r.pipeline(transaction=False)
+        for key in keys:
+            pipe.unlink(key)
+        pipe.unlink(self._dedup_key, self._ids_key)
+        pipe.execute()
+        self._seen_hashes.clear()
+        self._seen_order.clear()
+        self._has_memories = False
+        self._no_memories_until = 0.0
+        self._invalidate_search_cache()
+
+        count = len(keys)
         logger.info("[Redis] %d memoria(s) eliminada(s) para usuario '%s'", count, self.user_id)
         return count
 
     def close(self) -> None:
-        """Cierra la conexion a Redis."""
+        """Libera el cliente de Redis.
+
+        Como el pool es compartido (no lo creo este cliente), close() no lo
+        desconecta: las conexiones quedan disponibles para otras instancias.
+        """
         self.r.close()
         logger.info("[Redis] Conexion cerrada")
 
+    # Tabla de escapado para caracteres especiales de la sintaxis de
+    # RediSearch. Se construye una vez y se aplica con str.translate.
+    _ESCAPE_TABLE = str.maketrans(
+        {c: f"\\{c}" for c in r"@.{}()[]!|&~*^$\-:+=><%#\"'/"}
+    )
+
     @staticmethod
     def _escape_query(text: str) -> str:
         """Escapa caracteres especiales de la sintaxis de RediSearch."""
-        special_chars = r"@.{}()[]!|&~*^$\-:+=><%#\"'/"
-        escaped = []
-        for char in text:
-            if char in special_chars:
-                escaped.append(f"\\{char}")
-            else:
-                escaped.append(char)
-        return "".join(escaped)
+        return text.translate(RedisMemoryStore._ESCAPE_TABLE)
 
 
 # -- Extraccion de hechos con el LLM --
@@ -305,47 +648,60 @@ EXTRACT_FACTS_PROMPT = (
     "Ejemplos de hechos utiles: preferencias, ciudades favoritas, "
     "nombres, alergias, intereses, decisiones tomadas.\n\n"
     "Reglas:\n"
-    "- Devuelve SOLO un JSON array de strings, cada uno un hecho conciso.\n"
-    "- Si no hay hechos nuevos que extraer, devuelve un array vacio: []\n"
+    "- Devuelve cada hecho como un string conciso en la lista 'facts'.\n"
+    "- Si no hay hechos nuevos que extraer, devuelve una lista vacia.\n"
     "- No incluyas hechos triviales como saludos.\n"
     "- Escribe los hechos en tercera persona (ej: 'El usuario prefiere...').\n\n"
-    "Ejemplo de salida:\n"
-    '[\"La ciudad favorita del usuario es Tokio\", '
-    '\"El usuario prefiere temperaturas en Celsius\"]'
+    "Ejemplo de hechos:\n"
+    "- La ciudad favorita del usuario es Tokio\n"
+    "- El usuario prefiere temperaturas en Celsius"
 )
 
 
-def extract_facts(llm: ChatOpenAI, user_message: str, ai_response: str) -> list[str]:
-    """Usa el LLM para extraer hechos del turno de conversacion."""
-    chain = (
-        ChatPromptTemplate.from_messages(
-            [
-                ("system", EXTRACT_FACTS_PROMPT),
-                (
-                    "human",
-                    "Usuario dijo: {user_msg}\nAsistente respondio: {ai_msg}",
-                ),
-            ]
-        )
-        | llm
-        | StrOutputParser()
+class FactList(BaseModel):
+    """Hechos extraidos de un turno de conversacion."""
+
+    facts: list[str] = Field(
+        default_factory=list,
+        description="Hechos concisos sobre el usuario, en tercera persona.",
     )
 
-    raw = chain.invoke({"user_msg": user_message, "ai_msg": ai_response})
 
-    # Parsear el JSON
-    try:
-        # Limpiar posibles bloques de codigo markdown
-        cleaned = raw.strip()
-        if cleaned.startswith("```"):
-            cleaned = cleaned.split("\n", 1)[1].rsplit("```", 1)[0].strip()
-        facts = json.loads(cleaned)
-        if isinstance(facts, list):
-            return [f for f in facts if isinstance(f, str) and f.strip()]
-    except (json.JSONDecodeError, ValueError):
-        logger.info("[Memoria] No se pudo parsear la respuesta del LLM: %s", raw[:100])
+# El prompt no depende del LLM, asi que se compila una sola vez al importar.
+_EXTRACT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", EXTRACT_FACTS_PROMPT),
+        (
+            "human",
+            "Usuario dijo: {user_msg}\nAsistente respondio: {ai_msg}",
+        ),
+    ]
+)
+
+# Cadenas de extraccion ya construidas, una por instancia de LLM (por id).
+# La cadena mantiene una referencia al LLM, asi que el id no se reutiliza
+# mientras la entrada exista.
+_EXTRACT_CHAINS: dict[int, Runnable] = {}
+
+
+def _get_extract_chain(llm: ChatOpenAI) -> Runnable:
+    """Devuelve la cadena de extraccion de hechos para el LLM, creandola una sola vez.
+
+    Usa with_structured_output(FactList): el modelo devuelve directamente
+    un objeto validado, sin bloques markdown ni JSON que parsear a mano.
+    """
+    chain = _EXTRACT_CHAINS.get(id(llm))
+    if chain is None:
+        chain = _EXTRACT_PROMPT | llm.with_structured_output(FactList)
+        _EXTRACT_CHAINS[id(llm)] = chain
+    return chain
+
 
-    return []
+def extract_facts(llm: ChatOpenAI, user_message: str, ai_response: str) -> list[str]:
+    """Usa el LLM para extraer hechos del turno de conversacion."""
+    chain = _get_extract_chain(llm)
+    result: FactList = chain.invoke({"user_msg": user_message, "ai_msg": ai_response})
+    return [f for f in result.facts if f.strip()]
 
 
 # -- Clase principal: chat con memoria de largo plazo --
@@ -358,7 +714,7 @@ class MemoryEnhancedChat:
       1. Busca memorias relevantes en Redis (FT.SEARCH)
       2. Inyecta las memorias como contexto en el system prompt
 
-    Despues de cada turno:
+    Despues de cada turno (en segundo plano, sin bloquear la respuesta):
       3. Extrae hechos nuevos del turno usando el LLM
       4. Guarda cada hecho en Redis para futuras sesiones
 
@@ -379,6 +735,26 @@ class MemoryEnhancedChat:
         self.memory_store = memory_store
         self.conversation_history: list = []
 
+        # La cadena se construye una sola vez. El system prompt enriquecido
+        # con memorias cambia en cada turno, asi que se pasa como variable.
+        self._chat_chain = (
+            ChatPromptTemplate.from_messages(
+                [
+                    ("system", "{system}"),
+                    MessagesPlaceholder("history"),
+                    ("human", "{question}"),
+                ]
+            )
+            | llm
+            | StrOutputParser()
+        )
+
+        # La extraccion y el guardado de hechos corren en un hilo aparte para
+        # devolver la respuesta sin esperar la segunda llamada al LLM. Un solo
+        # worker mantiene el orden de escritura entre turnos.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending: list[Future] = []
+
     def _build_system_with_memories(self, query: str) -> str:
         """Construye el system prompt inyectando memorias relevantes."""
         memories = self.memory_store.search_memories(query)
@@ -395,6 +771,10 @@ class MemoryEnhancedChat:
 
     def chat(self, user_message: str, tool_data: str | None = None) -> str:
         """Envia un mensaje y devuelve la respuesta, con memoria de largo plazo."""
+        # 0. Los hechos del turno anterior deben estar en Redis antes de buscar.
+        # Normalmente ya terminaron mientras el usuario leia la respuesta.
+        self.flush()
+
         # 1. Buscar memorias relevantes e inyectarlas en el system prompt
         enriched_system = self._build_system_with_memories(user_message)
 
@@ -404,20 +784,9 @@ class MemoryEnhancedChat:
             full_message = f"{user_message}\n\n[Datos disponibles]: {tool_data}"
 
         # 3. Ejecutar la cadena
-        chain = (
-            ChatPromptTemplate.from_messages(
-                [
-                    ("system", enriched_system),
-                    MessagesPlaceholder("history"),
-                    ("human", "{question}"),
-                ]
-            )
-            | self.llm
-            | StrOutputParser()
-        )
-
-        response = chain.invoke(
+        response = self._chat_chain.invoke(
             {
+                "system": enriched_system,
                 "history": self.conversation_history,
                 "question": full_message,
             }
@@ -427,20 +796,36 @@ class MemoryEnhancedChat:
         self.conversation_history.append(HumanMessage(content=full_message))
         self.conversation_history.append(AIMessage(content=response))
 
-        # 5. Extraer hechos nuevos y guardarlos en Redis
-        facts = extract_facts(self.llm, user_message, response)
-        for fact in facts:
-            self.memory_store.save_memory(fact)
+        # 5. Extraer hechos nuevos y guardarlos en Redis (en segundo plano)
+        self._pending.append(
+            self._executor.submit(self._persist_turn, user_message, response)
+        )
+
+        return response
+
+    def _persist_turn(self, user_message: str, response: str) -> None:
+        """Extrae los hechos de un turno y los guarda en Redis."""
+        try:
+            facts = extract_facts(self.llm, user_message, response)
+            memory_ids = self.memory_store.save_memories(facts)
+        except Exception as e:
+            logger.warning("[Memoria] Error guardando hechos del turno: %s", e)
+            return
 
         if facts:
+            # save_memories devuelve "" para los duplicados omitidos
             logger.info(
-                "[Memoria] %d hecho(s) extraido(s) y guardados en Redis",
+                "[Memoria] %d hecho(s) extraido(s), %d guardado(s) en Redis",
                 len(facts),
+                sum(1 for memory_id in memory_ids if memory_id),
             )
         else:
             logger.info("[Memoria] No se extrajeron hechos nuevos de este turno")
 
-        return response
+    def flush(self) -> None:
+        """Espera a que terminen de guardarse los hechos de turnos anteriores."""
+        wait(self._pending)
+        self._pending.clear()
 
     def new_session(self) -> None:
         """Inicia una nueva sesion (limpia el historial en memoria, NO las memorias en Redis)."""
@@ -522,6 +907,7 @@ def main() -> None:
     print(f"[Agente]:  {resp4}\n")
 
     # -- Paso 4: Mostrar las memorias almacenadas en Redis --
+    chat.flush()
     print("--- Memorias almacenadas en Redis ---\n")
     all_memories = memory_store.get_all_memories()
     if all_memories:
@@ -35,12 +35,13 @@ Basado en agent_supervisor.py del repositorio Azure Agent Framework Demos,
 adaptado para usar LangChain con bind_tools().
 """
 
-import json
 import logging
 import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import orjson
 from dotenv import load_dotenv
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 from langchain_core.tools import tool
@@ -63,8 +64,33 @@ def make_llm() -> ChatOpenAI:
     )
 
 
+# Una sola instancia compartida por el supervisor y los subagentes. Todos
+# usan el mismo modelo y temperatura; bind_tools() solo envuelve el cliente
+# con herramientas distintas, asi que se reutiliza el mismo pool HTTP.
+base_llm = make_llm()
+
+# Generador aleatorio propio para las herramientas simuladas, separado del
+# generador global del modulo random (las tool calls corren en paralelo).
+_tool_rng = random.Random()
+
+
+def _invoke_tool(tool_map: dict, tool_call: dict) -> str:
+    """Ejecuta una tool call y serializa el resultado como texto."""
+    result = tool_map[tool_call["name"]].invoke(tool_call["args"])
+    if not isinstance(result, str):
+        result = orjson.dumps(result).decode()
+    return result
+
+
 def run(llm_with_tools, messages: list, tool_map: dict) -> str:
-    """Ejecuta el bucle de tool calling hasta obtener una respuesta final."""
+    """Ejecuta el bucle de tool calling hasta obtener una respuesta final.
+
+    Si el LLM pide varias herramientas en el mismo turno (ej: plan_weekend
+    y plan_meal), se ejecutan en paralelo con un pool de hilos: cada una
+    espera llamadas HTTP a OpenAI, asi que la latencia total es la de la
+    mas lenta en lugar de la suma. Los ToolMessage se agregan en el mismo
+    orden en que el LLM emitio las tool calls.
+    """
     while True:
         response: AIMessage = llm_with_tools.invoke(messages)
         messages.append(response)
@@ -72,10 +98,17 @@ def run(llm_with_tools, messages: list, tool_map: dict) -> str:
         if not response.tool_calls:
             return response.content
 
-        for tc in response.tool_calls:
-            result = tool_map[tc["name"]].invoke(tc["args"])
-            if not isinstance(result, str):
-                result = json.dumps(result, ensure_ascii=False)
+        if len(response.tool_calls) == 1:
+            results = [_invoke_tool(tool_map, response.tool_calls[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=len(response.tool_calls)) as executor:
+                futures = [
+                    executor.submit(_invoke_tool, tool_map, tc)
+                    for tc in response.tool_calls
+                ]
+                results = [f.result() for f in futures]
+
+        for tc, result in zip(response.tool_calls, results):
             messages.append(ToolMessage(content=result, tool_call_id=tc["id"]))
 
 
@@ -93,7 +126,7 @@ def get_current_date() -> str:
 def get_weather(city: str, date: str) -> dict:
     """Devuelve datos meteorologicos simulados para una ciudad y fecha."""
     logger.info("Obteniendo el clima para %s en %s", city, date)
-    if random.random() < 0.05:
+    if _tool_rng.random() < 0.05:
         return {"temperatura": 22, "descripcion": "soleado"}
     return {"temperatura": 15, "descripcion": "lluvioso"}
 
@@ -111,7 +144,7 @@ def get_activities(city: str, date: str) -> list[dict]:
 
 weekend_tools = [get_current_date, get_weather, get_activities]
 weekend_tool_map = {t.name: t for t in weekend_tools}
-weekend_llm = make_llm().bind_tools(weekend_tools)
+weekend_llm = base_llm.bind_tools(weekend_tools)
 
 
 def run_weekend_agent(query: str) -> str:
@@ -166,14 +199,14 @@ def find_recipes(query: str) -> list[dict]:
 def check_fridge() -> list[str]:
     """Devuelve los ingredientes actualmente en el refrigerador."""
     logger.info("Revisando ingredientes del refrigerador")
-    if random.random() < 0.5:
+    if _tool_rng.random() < 0.5:
         return ["pasta", "salsa de tomate", "pimientos", "aceite de oliva"]
     return ["tofu", "salsa de soja", "brocoli", "zanahorias"]
 
 
 meal_tools = [find_recipes, check_fridge]
 meal_tool_map = {t.name: t for t in meal_tools}
-meal_llm = make_llm().bind_tools(meal_tools)
+meal_llm = base_llm.bind_tools(meal_tools)
 
 
 def run_meal_agent(query: str) -> str:
@@ -211,7 +244,7 @@ def plan_meal(query: str) -> str:
 
 supervisor_tools = [plan_weekend, plan_meal]
 supervisor_tool_map = {t.name: t for t in supervisor_tools}
-supervisor_llm = make_llm().bind_tools(supervisor_tools)
+supervisor_llm = base_llm.bind_tools(supervisor_tools)
 
 
 # -- Punto de entrada --
@@ -27,13 +27,19 @@ Este ejemplo esta basado en agent_knowledge_postgres.py del repositorio
 de Azure Samples, adaptado para usar LangChain en lugar de Microsoft Agent Framework.
 """
 
+import functools
 import logging
 import os
 from typing import Any
 
+import numpy as np
+import orjson
 import psycopg
+from psycopg import sql
 from openai import OpenAI
+from pgvector import HalfVector
 from pgvector.psycopg import register_vector
+from psycopg_pool import ConnectionPool
 
 from dotenv import load_dotenv
 from langchain_core.documents import Document
@@ -60,6 +66,9 @@ OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
 LLM_MODEL = os.getenv("DEFAULT_LLM_MODEL", "gpt-4o-mini")
 LLM_TEMPERATURE = float(os.getenv("DEFAULT_LLM_TEMPERATURE", "0.7"))
 
+# Consultas de la demo que se procesan a la vez
+MAX_CONCURRENCY = 4
+
 POSTGRES_USER = os.getenv("POSTGRES_USER", "chris")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "chrisa7")
 POSTGRES_DB = os.getenv("POSTGRES_DB", "rag_pgvector")
@@ -74,16 +83,32 @@ POSTGRES_URL = (
 EMBEDDING_DIMENSIONS = 256
 EMBED_MODEL = "text-embedding-3-small"
 
+# Embeddings del catalogo ya calculados (una linea JSON por producto). Se
+# genera en la primera ejecucion; las siguientes no llaman a OpenAI para
+# los productos que ya estan en el archivo
+EMBEDDINGS_SNAPSHOT = "rag-pgvector/products_embeddings.jsonl"
+
 # Cliente de OpenAI para generar embeddings
 embed_client = OpenAI(api_key=OPENAI_API_KEY)
 
 
-def get_embedding(text: str) -> list[float]:
-    """Obtiene un vector de embedding para el texto dado."""
+def get_embeddings(texts: list[str]) -> list[list[float]]:
+    """Obtiene los vectores de embedding de varios textos en una sola llamada."""
     response = embed_client.embeddings.create(
-        input=text, model=EMBED_MODEL, dimensions=EMBEDDING_DIMENSIONS
+        input=texts, model=EMBED_MODEL, dimensions=EMBEDDING_DIMENSIONS
     )
-    return response.data[0].embedding
+    return [d.embedding for d in response.data]
+
+
+@functools.lru_cache(maxsize=1024)
+def get_embedding(text: str) -> tuple[float, ...]:
+    """Obtiene un vector de embedding para el texto dado.
+
+    Con modelo y dimensiones fijos el embedding de un texto siempre es el
+    mismo, asi que se cachea: una consulta repetida no vuelve a llamar a
+    OpenAI. Devuelve una tupla para que el valor cacheado sea inmutable.
+    """
+    return tuple(get_embeddings([text])[0])
 
 
 # -- Catalogo de productos (datos de ejemplo en espanol) --
@@ -167,6 +192,73 @@ PRODUCTS = [
 # -- Base de conocimiento (PostgreSQL + pgvector) --
 
 
+def load_product_embeddings(texts: list[str]) -> list[list[float]]:
+    """Devuelve el embedding de cada texto del catalogo usando el snapshot.
+
+    Solo se piden a OpenAI (en una sola llamada) los textos que no estan en
+    EMBEDDINGS_SNAPSHOT o que se generaron con otro modelo o dimension; en
+    ese caso el snapshot se reescribe con el catalogo actual.
+    """
+    cached: dict[str, list[float]] = {}
+    if os.path.exists(EMBEDDINGS_SNAPSHOT):
+        with open(EMBEDDINGS_SNAPSHOT, "rb") as f:
+            for line in f:
+                record = orjson.loads(line)
+                if (
+                    record["model"] == EMBED_MODEL
+                    and len(record["embedding"]) == EMBEDDING_DIMENSIONS
+                ):
+                    cached[record["text"]] = record["embedding"]
+
+    missing = [t for t in dict.fromkeys(texts) if t not in cached]
+    if not missing:
+        logger.info("[Base de conocimiento] Embeddings leidos de %s", EMBEDDINGS_SNAPSHOT)
+        return [cached[t] for t in texts]
+
+    logger.info(
+        "[Base de conocimiento] Generando embeddings para %d productos...",
+        len(missing),
+    )
+    # Un solo request a OpenAI para todos los faltantes, en lugar de uno por producto
+    cached.update(zip(missing, get_embeddings(missing)))
+    with open(EMBEDDINGS_SNAPSHOT, "wb") as f:
+        for text in texts:
+            record = {"model": EMBED_MODEL, "text": text, "embedding": cached[text]}
+            f.write(orjson.dumps(record) + b"\n")
+    return [cached[t] for t in texts]
+
+
+HNSW_INDEX_NAME = "products_embedding_bit_hnsw_idx"
+
+# Candidatos que trae el prefiltro binario (distancia Hamming) antes de
+# reordenarlos por similitud coseno con el halfvec completo
+BIT_PREFILTER_CANDIDATES = 200
+
+# Expresion indexada por el HNSW binario. Se compone una sola vez con
+# psycopg.sql (la dimension como literal) y se reutiliza al crear el indice,
+# en la busqueda y en check_hnsw_plan, asi las tres son siempre identicas
+BIT_EMBEDDING_SQL = sql.SQL("binary_quantize(embedding)::bit({dims})").format(
+    dims=sql.Literal(EMBEDDING_DIMENSIONS)
+)
+
+
+def configure_hnsw_params(vector_count: int) -> dict[str, int]:
+    """Parametros del indice HNSW segun el tamano del catalogo.
+
+    - m: vecinos por nodo del grafo (mas = mejor recall, indice mas grande)
+    - ef_construction: candidatos evaluados al construir el indice
+    - ef_search: candidatos evaluados en cada consulta (debe ser >= LIMIT
+      del prefiltro binario, BIT_PREFILTER_CANDIDATES)
+
+    Los valores por defecto de pgvector (m=16, ef_construction=64) dan un
+    recall ~0.99 en catalogos pequenos y medianos; a partir de ~100k
+    vectores conviene un grafo mas denso.
+    """
+    if vector_count > 100_000:
+        return {"m": 24, "ef_construction": 128, "ef_search": 2 * BIT_PREFILTER_CANDIDATES}
+    return {"m": 16, "ef_construction": 64, "ef_search": BIT_PREFILTER_CANDIDATES}
+
+
 def create_knowledge_db(conn: psycopg.Connection) -> None:
     """Crea el catalogo de productos en PostgreSQL con pgvector e indices de texto completo."""
     conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
@@ -174,74 +266,171 @@ def create_knowledge_db(conn: psycopg.Connection) -> None:
 
     conn.execute("DROP TABLE IF EXISTS products")
     conn.execute(
-        f"""
-        CREATE TABLE products (
-            id          SERIAL PRIMARY KEY,
-            name        TEXT NOT NULL,
-            category    TEXT NOT NULL,
-            price       REAL NOT NULL,
-            description TEXT NOT NULL,
-            embedding   vector({EMBEDDING_DIMENSIONS})
-        )
-        """
+        sql.SQL(
+            """
+            CREATE TABLE products (
+                id          SERIAL PRIMARY KEY,
+                name        TEXT NOT NULL,
+                category    TEXT NOT NULL,
+                price       REAL NOT NULL,
+                description TEXT NOT NULL,
+                embedding   halfvec({dims}),
+                tsv         tsvector GENERATED ALWAYS AS (
+                                to_tsvector('spanish', name || ' ' || description)
+                            ) STORED
+            )
+            """
+        ).format(dims=sql.Literal(EMBEDDING_DIMENSIONS))
     )
-    # Indice GIN para busqueda de texto completo sobre nombre + descripcion (idioma espanol)
+    # Indice GIN para busqueda de texto completo sobre nombre + descripcion (idioma espanol).
+    # La columna generada 'tsv' se tokeniza una sola vez al insertar, no en cada consulta.
+    conn.execute("CREATE INDEX ON products USING GIN (tsv)")
+    # Indice de cobertura para PRODUCTS_BY_ID_SQL: incluye las columnas que
+    # lee la consulta, asi PostgreSQL las devuelve con un Index Only Scan sin
+    # visitar la tabla (heap)
     conn.execute(
-        "CREATE INDEX ON products USING GIN (to_tsvector('spanish', name || ' ' || description))"
+        "CREATE UNIQUE INDEX products_pk_covering ON products (id) "
+        "INCLUDE (name, category, price, description)"
     )
 
-    logger.info(
-        "[Base de conocimiento] Generando embeddings para %d productos...",
-        len(PRODUCTS),
-    )
-    for product in PRODUCTS:
-        text_for_embedding = (
-            f"{product['name']} - {product['category']}: {product['description']}"
-        )
-        embedding = get_embedding(text_for_embedding)
-        conn.execute(
-            "INSERT INTO products (name, category, price, description, embedding) "
-            "VALUES (%s, %s, %s, %s, %s)",
-            (
-                product["name"],
-                product["category"],
-                product["price"],
-                product["description"],
-                embedding,
-            ),
+    texts = [f"{p['name']} - {p['category']}: {p['description']}" for p in PRODUCTS]
+    embeddings = load_product_embeddings(texts)
+
+    # COPY en formato binario: todas las filas viajan en un solo flujo y los
+    # halfvec se envian ya serializados, sin convertirlos a texto
+    with conn.cursor() as cur, cur.copy(
+        "COPY products (name, category, price, description, embedding) "
+        "FROM STDIN (FORMAT BINARY)"
+    ) as copy:
+        copy.set_types(["text", "text", "float4", "text", "halfvec"])
+        for p, embedding in zip(PRODUCTS, embeddings):
+            copy.write_row(
+                (p["name"], p["category"], p["price"], p["description"], HalfVector(embedding))
+            )
+
+    # Indice HNSW sobre la version binaria del embedding (1 bit por dimension,
+    # 32 bytes por producto) con distancia Hamming: comparar dos vectores es
+    # un XOR + POPCNT en lugar de 256 multiplicaciones. Solo sirve de prefiltro;
+    # los candidatos se reordenan despues con el halfvec completo (float16),
+    # asi el recall queda casi igual al de un indice sobre halfvec.
+    # binary_quantize sobre halfvec requiere pgvector >= 0.7.
+    hnsw = configure_hnsw_params(len(PRODUCTS))
+    conn.execute(
+        sql.SQL(
+            "CREATE INDEX {index} ON products USING hnsw (({expr}) bit_hamming_ops) "
+            "WITH (m = {m}, ef_construction = {ef_construction})"
+        ).format(
+            index=sql.Identifier(HNSW_INDEX_NAME),
+            expr=BIT_EMBEDDING_SQL,
+            m=sql.Literal(hnsw["m"]),
+            ef_construction=sql.Literal(hnsw["ef_construction"]),
         )
+    )
 
     conn.commit()
+
+    # VACUUM marca las paginas como visibles para todos (visibility map), sin
+    # lo cual el Index Only Scan igual tendria que consultar el heap; ANALYZE
+    # actualiza las estadisticas del planner. VACUUM no puede ejecutarse
+    # dentro de una transaccion
+    conn.autocommit = True
+    conn.execute("VACUUM ANALYZE products")
     logger.info("[Base de conocimiento] Catalogo cargado con embeddings.")
 
 
 # -- SQL de busqueda hibrida con Reciprocal Rank Fusion (RRF) --
 # Combina resultados de similitud vectorial y busqueda de texto completo
 
-HYBRID_SEARCH_SQL = f"""
-WITH semantic_search AS (
-    SELECT id, RANK() OVER (ORDER BY embedding <=> %(embedding)s::vector({EMBEDDING_DIMENSIONS})) AS rank
-    FROM products
-    ORDER BY embedding <=> %(embedding)s::vector({EMBEDDING_DIMENSIONS})
-    LIMIT 20
-),
-keyword_search AS (
-    SELECT id, RANK() OVER (ORDER BY ts_rank_cd(to_tsvector('spanish', name || ' ' || description), query) DESC)
-    FROM products, plainto_tsquery('spanish', %(query)s) query
-    WHERE to_tsvector('spanish', name || ' ' || description) @@ query
-    ORDER BY ts_rank_cd(to_tsvector('spanish', name || ' ' || description), query) DESC
-    LIMIT 20
-)
+# Constante k de RRF y candidatos que aporta cada busqueda a la fusion
+RRF_K = 60
+RRF_CANDIDATES = 20
+
+# Devuelve en un solo round-trip los ids ordenados de cada busqueda; la fusion
+# RRF se hace en el cliente con NumPy (ver rrf_fuse), asi PostgreSQL no arma
+# tablas hash para combinarlos y la lista de candidatos puede crecer sin costo
+# extra en el servidor.
+# La busqueda semantica tiene dos etapas: la subconsulta interna trae
+# BIT_PREFILTER_CANDIDATES productos por distancia Hamming usando el indice
+# HNSW binario y la externa los reordena por distancia coseno exacta.
+# El embedding se pasa como pgvector.HalfVector (con register_vector), asi que
+# llega con el tipo halfvec y no hace falta castearlo. La expresion del ORDER BY
+# interno debe ser exactamente la del indice, en orden ASC, para que PostgreSQL
+# pueda usarlo. La consulta se compone una sola vez al importar el modulo
+# (sin f-strings), asi el texto es siempre el mismo y la sentencia preparada
+# se reutiliza.
+HYBRID_SEARCH_SQL = sql.SQL("""
 SELECT
-    COALESCE(semantic_search.id, keyword_search.id) AS id,
-    COALESCE(1.0 / (%(k)s + semantic_search.rank), 0.0) +
-    COALESCE(1.0 / (%(k)s + keyword_search.rank), 0.0) AS score
-FROM semantic_search
-FULL OUTER JOIN keyword_search ON semantic_search.id = keyword_search.id
+    ARRAY(
+        SELECT id
+        FROM (
+            SELECT id, embedding
+            FROM products
+            ORDER BY {bit_embedding} <~> binary_quantize(%(embedding)s)
+            LIMIT {prefilter}
+        ) prefilter
+        ORDER BY embedding <=> %(embedding)s
+        LIMIT %(candidates)s
+    ) AS semantic_ids,
+    ARRAY(
+        SELECT id
+        FROM products, plainto_tsquery('spanish', %(query)s) query
+        WHERE tsv @@ query
+        ORDER BY ts_rank_cd(tsv, query) DESC
+        LIMIT %(candidates)s
+    ) AS keyword_ids
+""").format(
+    bit_embedding=BIT_EMBEDDING_SQL,
+    prefilter=sql.Literal(BIT_PREFILTER_CANDIDATES),
+)
+
+# Detalles de los productos ganadores de la fusion
+PRODUCTS_BY_ID_SQL = """
+SELECT id, name, category, price, description
+FROM products
+WHERE id = ANY(%(ids)s)
+"""
+
+
+def rrf_fuse(
+    semantic_ids: list[int], keyword_ids: list[int], limit: int, k: int = RRF_K
+) -> list[tuple[int, float]]:
+    """Fusiona dos rankings de ids con RRF y devuelve los `limit` mejores.
+
+    Cada id suma 1 / (k + posicion) por cada lista en la que aparece (las
+    posiciones empiezan en 1); un id ausente de una lista no suma nada.
+    """
+    sem = np.asarray(semantic_ids, dtype=np.intp)
+    kw = np.asarray(keyword_ids, dtype=np.intp)
+    if sem.size == 0 and kw.size == 0:
+        return []
+
+    scores = np.zeros(max(sem.max(initial=0), kw.max(initial=0)) + 1)
+    np.add.at(scores, sem, 1.0 / (k + np.arange(1, sem.size + 1)))
+    np.add.at(scores, kw, 1.0 / (k + np.arange(1, kw.size + 1)))
+
+    # argpartition selecciona los mejores en O(n); solo ellos se ordenan
+    candidates = np.flatnonzero(scores)
+    if candidates.size > limit:
+        top = np.argpartition(-scores[candidates], limit - 1)[:limit]
+        candidates = candidates[top]
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return [(int(i), float(scores[i])) for i in candidates]
+
+
+# Solo la parte de palabras clave, con los detalles del producto. Se ejecuta
+# antes que la hibrida: si ya hay suficientes coincidencias fuertes, no hace
+# falta generar el embedding de la consulta (una llamada menos a OpenAI).
+KEYWORD_SEARCH_SQL = """
+SELECT name, category, price, description, ts_rank_cd(tsv, query) AS score
+FROM products, plainto_tsquery('spanish', %(query)s) query
+WHERE tsv @@ query
 ORDER BY score DESC
 LIMIT %(limit)s
 """
 
+# ts_rank_cd minimo del peor resultado para responder solo con palabras clave
+KEYWORD_ONLY_MIN_RANK = 0.1
+
 
 # -- Retriever personalizado para busqueda hibrida en PostgreSQL --
 
@@ -255,57 +444,82 @@ class PostgresHybridRetriever(BaseRetriever):
     por separado.
     """
 
-    db_conn: Any  # psycopg.Connection
+    pool: Any  # psycopg_pool.ConnectionPool
     max_results: int = 3
 
     model_config = {"arbitrary_types_allowed": True}
 
     def _get_relevant_documents(self, query: str, **kwargs: Any) -> list[Document]:
-        """Ejecuta busqueda hibrida y devuelve documentos relevantes."""
+        """Ejecuta busqueda hibrida y devuelve documentos relevantes.
+
+        Primero prueba solo con palabras clave: si devuelven max_results
+        productos con buen ts_rank_cd, la parte semantica no cambiaria el
+        resultado lo suficiente como para pagar el embedding de la consulta.
+        """
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                KEYWORD_SEARCH_SQL,
+                {"query": query, "limit": self.max_results},
+                prepare=True,
+            ).fetchall()
+        if len(rows) >= self.max_results and rows[-1][4] >= KEYWORD_ONLY_MIN_RANK:
+            logger.info(
+                "[Retriever] Coincidencias fuertes por palabras clave, se omite el embedding"
+            )
+            return self._to_documents(rows, query)
+
         logger.info("[Retriever] Generando embedding para la consulta...")
-        query_embedding = get_embedding(query)
+        # El cache guarda una tupla; pgvector >= 0.5 solo acepta list o ndarray
+        query_embedding = HalfVector(list(get_embedding(query)))
 
         logger.info(
             "[Retriever] Ejecutando busqueda hibrida (semantica + palabras clave)..."
         )
-        cursor = self.db_conn.execute(
-            HYBRID_SEARCH_SQL,
-            {
-                "embedding": query_embedding,
-                "query": query,
-                "k": 60,
-                "limit": self.max_results,
-            },
-        )
-        result_ids = [row[0] for row in cursor.fetchall()]
+        with self.pool.connection() as conn:
+            semantic_ids, keyword_ids = conn.execute(
+                HYBRID_SEARCH_SQL,
+                {
+                    "embedding": query_embedding,
+                    "query": query,
+                    "candidates": RRF_CANDIDATES,
+                },
+                # Sentencia preparada en el servidor desde la primera ejecucion:
+                # PostgreSQL reutiliza el parseo y el plan en las siguientes
+                prepare=True,
+            ).fetchone()
+            fused = rrf_fuse(semantic_ids, keyword_ids, self.max_results)
+            if not fused:
+                return self._to_documents([], query)
+            details = {
+                row[0]: row[1:]
+                for row in conn.execute(
+                    PRODUCTS_BY_ID_SQL,
+                    {"ids": [product_id for product_id, _ in fused]},
+                    prepare=True,
+                )
+            }
+        rows = [(*details[product_id], score) for product_id, score in fused]
+        return self._to_documents(rows, query)
+
+    @staticmethod
+    def _to_documents(rows: list[tuple], query: str) -> list[Document]:
+        """Convierte filas (name, category, price, description, score) en documentos."""
+        # Los detalles de todos los productos llegan en una sola consulta,
+        # sin un SELECT adicional por resultado
+        documents = [
+            Document(
+                page_content=f"- **{name}** ({category}, ${price:.2f}): {description}",
+                metadata={"name": name, "category": category, "price": price},
+            )
+            for name, category, price, description, _score in rows
+        ]
 
-        if not result_ids:
+        if not documents:
             logger.info(
                 "[Retriever] No se encontraron productos para: %s", query
             )
             return []
 
-        # Obtener detalles completos de los productos encontrados
-        documents = []
-        for product_id in result_ids:
-            row = self.db_conn.execute(
-                "SELECT name, category, price, description FROM products WHERE id = %s",
-                (product_id,),
-            ).fetchone()
-            if row:
-                documents.append(
-                    Document(
-                        page_content=(
-                            f"- **{row[0]}** ({row[1]}, ${row[2]:.2f}): {row[3]}"
-                        ),
-                        metadata={
-                            "name": row[0],
-                            "category": row[1],
-                            "price": row[2],
-                        },
-                    )
-                )
-
         logger.info(
             "[Retriever] %d producto(s) encontrado(s) para: %s",
             len(documents),
@@ -351,16 +565,80 @@ prompt = ChatPromptTemplate.from_messages(
 )
 
 
-def setup_db() -> psycopg.Connection:
-    """Conecta a PostgreSQL y carga la base de conocimiento."""
+def check_hnsw_plan(conn: psycopg.Connection) -> bool:
+    """Verifica que la busqueda semantica puede usar el indice HNSW.
+
+    Ejecuta EXPLAIN del prefiltro binario de HYBRID_SEARCH_SQL con el scan
+    secuencial desactivado (con 8 productos el planner lo preferiria). Si el
+    plan no usa el indice, la expresion del ORDER BY no coincide con la del
+    indice y la busqueda degradaria a un scan secuencial al crecer la tabla.
+    """
+    probe = HalfVector([0.0] * EMBEDDING_DIMENSIONS)
+    with conn.transaction():
+        conn.execute("SET LOCAL enable_seqscan = off")
+        cur = psycopg.ClientCursor(conn)
+        cur.execute(
+            sql.SQL(
+                "EXPLAIN SELECT id FROM products "
+                "ORDER BY {bit_embedding} <~> binary_quantize(%s) LIMIT {prefilter}"
+            ).format(
+                bit_embedding=BIT_EMBEDDING_SQL,
+                prefilter=sql.Literal(BIT_PREFILTER_CANDIDATES),
+            ),
+            (probe,),
+        )
+        plan = "\n".join(row[0] for row in cur.fetchall())
+
+    uses_index = HNSW_INDEX_NAME in plan
+    if uses_index:
+        logger.info("[Base de conocimiento] La busqueda semantica usa el indice HNSW")
+    else:
+        logger.warning(
+            "[Base de conocimiento] La busqueda semantica NO usa el indice HNSW:\n%s",
+            plan,
+        )
+    return uses_index
+
+
+def configure_connection(conn: psycopg.Connection) -> None:
+    """Prepara cada conexion nueva del pool.
+
+    Registra los tipos de pgvector (para enviar y recibir HalfVector) y fija
+    hnsw.ef_search, que es un parametro de sesion. Se ejecuta una sola vez
+    por conexion, no en cada consulta.
+    """
+    register_vector(conn)
+    ef_search = configure_hnsw_params(len(PRODUCTS))["ef_search"]
+    conn.execute("SELECT set_config('hnsw.ef_search', %s, false)", (str(ef_search),))
+    conn.commit()
+
+
+def setup_db() -> ConnectionPool:
+    """Carga la base de conocimiento y devuelve un pool de conexiones a PostgreSQL.
+
+    Cada consulta del retriever toma una conexion del pool y la devuelve al
+    terminar, asi que varias cadenas RAG pueden buscar en paralelo y una
+    conexion rota se reemplaza automaticamente.
+    """
     logger.info(
         "[Base de conocimiento] Conectando a PostgreSQL en %s:%s...",
         POSTGRES_HOST,
         POSTGRES_PORT,
     )
-    conn = psycopg.connect(POSTGRES_URL)
-    create_knowledge_db(conn)
-    return conn
+    # La extension vector debe existir antes de que el pool registre sus tipos
+    with psycopg.connect(POSTGRES_URL) as conn:
+        create_knowledge_db(conn)
+
+    pool = ConnectionPool(
+        POSTGRES_URL,
+        min_size=2,
+        max_size=10,
+        configure=configure_connection,
+        open=True,
+    )
+    with pool.connection() as conn:
+        check_hnsw_plan(conn)
+    return pool
 
 
 # -- Punto de entrada --
@@ -368,10 +646,10 @@ def setup_db() -> psycopg.Connection:
 
 def main() -> None:
     """Demuestra el patron de recuperacion de conocimiento (RAG) con busqueda hibrida."""
-    db_conn = setup_db()
+    pool = setup_db()
 
     # Crear el retriever
-    retriever = PostgresHybridRetriever(db_conn=db_conn, max_results=3)
+    retriever = PostgresHybridRetriever(pool=pool, max_results=3)
 
     # Construir la cadena RAG
     rag_chain = (
@@ -402,12 +680,14 @@ def main() -> None:
         "    (pgvector [semantica] + tsvector [palabras clave] con RRF)\n"
     )
 
-    for query in queries:
+    # Las consultas son independientes: batch las ejecuta en paralelo (hilos),
+    # asi que el tiempo total es el de la consulta mas lenta y no la suma
+    responses = rag_chain.batch(queries, config={"max_concurrency": MAX_CONCURRENCY})
+    for query, response in zip(queries, responses):
         print(f"[Usuario]: {query}")
-        response = rag_chain.invoke(query)
         print(f"[Agente]:  {response}\n")
 
-    db_conn.close()
+    pool.close()
 
 
 if __name__ == "__main__":
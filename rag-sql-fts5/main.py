@@ -18,6 +18,7 @@ import logging
 import re
 import sqlite3
 import os
+from contextlib import closing
 from typing import Any
 
 from dotenv import load_dotenv
@@ -45,6 +46,9 @@ OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
 LLM_MODEL = os.getenv("DEFAULT_LLM_MODEL", "gpt-4o-mini")
 LLM_TEMPERATURE = float(os.getenv("DEFAULT_LLM_TEMPERATURE", "0.7"))
 
+# Consultas de la demo que se procesan a la vez
+MAX_CONCURRENCY = 4
+
 
 # -- Catalogo de productos (datos de ejemplo) --
 
@@ -124,12 +128,34 @@ PRODUCTS = [
 ]
 
 
+# Palabras de la consulta; se compila una vez en lugar de en cada busqueda
+_WORD_RE = re.compile(r"\w+")
+
+# Palabras vacias en espanol que no aportan a la busqueda. FTS5 no tiene
+# lista de stop-words propia, asi que se descartan antes de armar la consulta
+_STOP_WORDS = frozenset({
+    "al", "algo", "alguna", "alguno", "como", "con", "cual", "cuales", "de",
+    "del", "desde", "donde", "el", "ella", "ellos", "en", "es", "esta",
+    "este", "estoy", "hay", "la", "las", "le", "les", "lo", "los", "mas",
+    "me", "mi", "mis", "muy", "nos", "para", "pero", "por", "que", "se",
+    "sin", "sobre", "su", "sus", "te", "tiene", "tienen", "tu", "un", "una",
+    "unas", "uno", "unos", "ya", "yo",
+})
+
+
 # -- Base de conocimiento (SQLite + FTS5) --
 
 
 def create_knowledge_db(db_path: str) -> sqlite3.Connection:
     """Crea (o recrea) el catalogo de productos en SQLite con un indice FTS5."""
     conn = sqlite3.connect(db_path, check_same_thread=False)
+    # WAL evita reescribir el journal completo en cada commit y con
+    # synchronous=NORMAL solo se hace fsync en los checkpoints
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # Leer la base mapeada en memoria (hasta 256 MB) evita copiar cada pagina
+    # desde el cache del sistema operativo al de SQLite en las consultas
+    conn.execute("PRAGMA mmap_size=268435456")
 
     # Eliminar tablas existentes para empezar de nuevo
     conn.execute("DROP TABLE IF EXISTS products_fts")
@@ -146,30 +172,63 @@ def create_knowledge_db(db_path: str) -> sqlite3.Connection:
         )
         """
     )
-    conn.executemany(
-        "INSERT INTO products (name, category, price, description) VALUES (?, ?, ?, ?)",
-        [(p["name"], p["category"], p["price"], p["description"]) for p in PRODUCTS],
-    )
 
-    # Construir indice de busqueda de texto completo sobre nombre, categoria y descripcion
+    # Construir indice de busqueda de texto completo sobre nombre, categoria y descripcion.
+    # unicode61 pasa a minusculas y con remove_diacritics 2 quita los acentos
+    # tanto al indexar como al consultar ("excursión" coincide con "excursion")
     conn.execute(
         """
         CREATE VIRTUAL TABLE products_fts USING fts5(
             name, category, description,
             content='products',
-            content_rowid='id'
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
         )
         """
     )
+
+    # Ranking por defecto de la columna oculta `rank`: bm25 con pesos por
+    # columna (nombre > categoria > descripcion). Se guarda en la configuracion
+    # del indice, asi que las consultas pueden usar ORDER BY rank
     conn.execute(
-        "INSERT INTO products_fts (rowid, name, category, description) "
-        "SELECT id, name, category, description FROM products"
+        "INSERT INTO products_fts (products_fts, rank) "
+        "VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')"
     )
-    conn.commit()
+
+    # Cargar productos e indice FTS5 en la misma transaccion y con los mismos
+    # datos en memoria, sin una segunda pasada INSERT ... SELECT sobre products
+    rows = [
+        (i, p["name"], p["category"], p["price"], p["description"])
+        for i, p in enumerate(PRODUCTS, start=1)
+    ]
+    with conn:
+        conn.executemany(
+            "INSERT INTO products (id, name, category, price, description) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.executemany(
+            "INSERT INTO products_fts (rowid, name, category, description) "
+            "VALUES (?, ?, ?, ?)",
+            [(i, name, category, description) for i, name, category, _, description in rows],
+        )
     logger.info("[Base de conocimiento] Creada con %d productos", len(PRODUCTS))
     return conn
 
 
+def open_readonly(db_path: str) -> sqlite3.Connection:
+    """Abre una conexion de solo lectura a la base de conocimiento.
+
+    Cada consulta del retriever usa su propia conexion: con rag_chain.batch
+    las consultas corren en varios hilos, y un objeto sqlite3.Connection no
+    se puede usar desde varios hilos a la vez. Con WAL los lectores no se
+    bloquean entre si ni bloquean al escritor.
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+
 # -- Retriever personalizado para SQLite FTS5 --
 
 
@@ -181,53 +240,72 @@ class SQLiteFTS5Retriever(BaseRetriever):
     LLM genere su respuesta.
     """
 
-    db_conn: Any  # sqlite3.Connection
+    db_path: str
     max_results: int = 3
 
-    model_config = {"arbitrary_types_allowed": True}
-
     def _get_relevant_documents(self, query: str, **kwargs: Any) -> list[Document]:
-        """Ejecuta una consulta FTS5 y devuelve documentos relevantes."""
-        # Extraer palabras, filtrar cortas (len <= 2 elimina "a", "de", "el", etc.)
-        words = re.findall(r"[a-zA-ZáéíóúñÁÉÍÓÚÑ]+", query)
-        tokens = [w.lower() for w in words if len(w) > 2]
+        """Ejecuta una consulta FTS5 y devuelve documentos relevantes.
+
+        Los resultados se ordenan por `rank`, configurado al crear el
+        indice como bm25() ponderando las columnas: una coincidencia en el
+        nombre pesa mas que en la categoria, y esta mas que en la
+        descripcion. FTS5 optimiza ORDER BY rank + LIMIT mejor que un
+        ORDER BY bm25(...) explicito.
+
+        Los detalles salen de `products` en el mismo JOIN por rowid (la
+        clave primaria), sin un SELECT por resultado ni indices extra.
+        """
+        # Extraer palabras y descartar las vacias; minusculas y acentos los
+        # normaliza el tokenizador unicode61 de FTS5, no hace falta aqui.
+        # Las palabras solo tienen caracteres \w, asi que no pueden cerrar
+        # las comillas de la frase ni inyectar operadores FTS5
+        tokens = [
+            w
+            for w in (m.group() for m in _WORD_RE.finditer(query))
+            if len(w) > 1 and w.casefold() not in _STOP_WORDS
+        ]
         if not tokens:
             logger.info("[Retriever] No se encontraron tokens validos en: %s", query)
             return []
 
-        fts_query = " OR ".join(tokens)
+        # Cada token entre comillas es una frase FTS5 (no se interpreta como
+        # operador) y el sufijo * permite coincidencias por prefijo
+        # ("bota" encuentra "botas")
+        fts_query = " OR ".join(f'"{t}"*' for t in tokens)
         logger.info("[Retriever] Consulta FTS5: %s", fts_query)
 
-        try:
-            cursor = self.db_conn.execute(
-                """
-                SELECT p.name, p.category, p.price, p.description
-                FROM products_fts fts
-                JOIN products p ON fts.rowid = p.id
-                WHERE products_fts MATCH ?
-                ORDER BY rank
-                LIMIT ?
-                """,
-                (fts_query, self.max_results),
-            )
-            results = [
-                Document(
-                    page_content=(
-                        f"- **{row[0]}** ({row[1]}, ${row[2]:.2f}): {row[3]}"
-                    ),
-                    metadata={"name": row[0], "category": row[1], "price": row[2]},
-                )
-                for row in cursor.fetchall()
-            ]
-            logger.info(
-                "[Retriever] %d producto(s) encontrado(s) para: %s",
-                len(results),
-                query,
+        with closing(open_readonly(self.db_path)) as conn:
+            try:
+                rows = conn.execute(
+                    """
+                    SELECT p.name, p.category, p.price, p.description
+                    FROM products_fts fts
+                    JOIN products p ON fts.rowid = p.id
+                    WHERE products_fts MATCH ?
+                    ORDER BY rank
+                    LIMIT ?
+                    """,
+                    (fts_query, self.max_results),
+                ).fetchall()
+            except sqlite3.OperationalError as e:
+                # Consulta FTS5 invalida: se responde sin contexto. Los demas
+                # errores (abrir la base, base corrupta, etc.) se propagan
+                logger.warning("Consulta FTS fallo para: %s - %s", fts_query, e)
+                return []
+
+        results = [
+            Document(
+                page_content=f"- **{row[0]}** ({row[1]}, ${row[2]:.2f}): {row[3]}",
+                metadata={"name": row[0], "category": row[1], "price": row[2]},
             )
-            return results
-        except Exception as e:
-            logger.warning("Consulta FTS fallo para: %s - %s", fts_query, e)
-            return []
+            for row in rows
+        ]
+        logger.info(
+            "[Retriever] %d producto(s) encontrado(s) para: %s",
+            len(results),
+            query,
+        )
+        return results
 
 
 # -- Formatear documentos para el contexto del LLM --
@@ -271,7 +349,7 @@ DB_PATH = "rag-sql-fts5/knowledge.sqlite3"
 db_conn = create_knowledge_db(DB_PATH)
 
 # Crear el retriever
-retriever = SQLiteFTS5Retriever(db_conn=db_conn, max_results=3)
+retriever = SQLiteFTS5Retriever(db_path=DB_PATH, max_results=3)
 
 # Construir la cadena RAG
 rag_chain = (
@@ -301,9 +379,11 @@ def main() -> None:
 
     print("\n=== Demo de Recuperacion de Conocimiento (RAG) con SQLite FTS5 ===\n")
 
-    for query in queries:
+    # Las consultas son independientes: batch las ejecuta en paralelo (hilos),
+    # asi que el tiempo total es el de la consulta mas lenta y no la suma
+    responses = rag_chain.batch(queries, config={"max_concurrency": MAX_CONCURRENCY})
+    for query, response in zip(queries, responses):
         print(f"[Usuario]: {query}")
-        response = rag_chain.invoke(query)
         print(f"[Agente]:  {response}\n")
 
     db_conn.close()
@@ -31,20 +31,30 @@ Este ejemplo esta basado en agent_history_sqlite.py del repositorio
 de Azure Samples, adaptado para usar LangChain.
 """
 
-import json
+import atexit
+import functools
+import itertools
 import logging
 import os
+import queue
 import random
 import sqlite3
+import threading
 import uuid
 
+import orjson
 from dotenv import load_dotenv
+from langchain_community.cache import SQLiteCache
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import (
+    AIMessage,
     BaseMessage,
+    HumanMessage,
+    SystemMessage,
     message_to_dict,
     messages_from_dict,
 )
+from langchain_core.globals import set_llm_cache
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
@@ -66,22 +76,363 @@ load_dotenv(override=True)
 OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
 LLM_MODEL = os.getenv("DEFAULT_LLM_MODEL", "gpt-4o-mini")
 LLM_TEMPERATURE = float(os.getenv("DEFAULT_LLM_TEMPERATURE", "0.7"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "sqlite-history/llm_cache.sqlite3")
 
 
 # -- Herramienta simulada (datos ficticios) --
 
 
+# Todas las combinaciones (condicion, temperatura), precalculadas una vez:
+# cada llamada elige una con un solo random.choice
+_WEATHER_TABLE = tuple(
+    (condition, temp)
+    for condition in ("soleado", "nublado", "lluvioso", "tormentoso")
+    for temp in range(10, 31)
+)
+
+
 def get_weather(city: str) -> str:
     """Devuelve datos del clima simulados para una ciudad."""
-    conditions = ["soleado", "nublado", "lluvioso", "tormentoso"]
-    temp = random.randint(10, 30)
-    condition = conditions[random.randint(0, 3)]
+    condition, temp = random.choice(_WEATHER_TABLE)
     return f"El clima en {city} esta {condition} con una temperatura maxima de {temp} C."
 
 
 # -- Historial persistente con SQLite --
 
 
+# Version del esquema guardada en PRAGMA user_version.
+# 1: message_json guarda los bytes UTF-8 del JSON (BLOB, escrito con orjson)
+# 2: indice compuesto (session_id, id) en lugar del de solo session_id
+SCHEMA_VERSION = 2
+
+
+@functools.lru_cache(maxsize=None)
+def _ensure_schema(db_path: str) -> None:
+    """Crea la tabla e indice de mensajes una sola vez por archivo y proceso.
+
+    Las bases creadas antes de SCHEMA_VERSION 1 guardaban el JSON como TEXT;
+    se convierten a BLOB (los bytes son los mismos, solo cambia el tipo).
+    """
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                message_json BLOB NOT NULL
+            )
+            """
+        )
+        # Todas las lecturas son WHERE session_id = ? ORDER BY id: con el indice
+        # compuesto SQLite recorre las filas de la sesion ya ordenadas, sin un
+        # paso de ordenamiento (EXPLAIN QUERY PLAN no muestra "USE TEMP B-TREE")
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_messages_session_id
+            ON messages (session_id, id)
+            """
+        )
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            conn.execute(
+                "UPDATE messages SET message_json = CAST(message_json AS BLOB) "
+                "WHERE typeof(message_json) = 'text'"
+            )
+        if version < 2:
+            conn.execute("DROP INDEX IF EXISTS idx_messages_session")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.close()
+
+
+def _configure_pragmas(conn: sqlite3.Connection) -> None:
+    """Ajusta la conexion para escrituras rapidas (requiere SQLite >= 3.7).
+
+    - journal_mode=WAL: cada commit agrega paginas al final del WAL en vez
+      de reescribir un rollback journal, y los lectores no bloquean al
+      escritor (ni al reves).
+    - synchronous=NORMAL: con WAL solo se hace fsync en los checkpoints,
+      no en cada commit; la base sigue siendo consistente ante un corte.
+    - temp_store=MEMORY, cache_size=-20000 (~20 MB) y mmap_size (256 MB)
+      reducen lecturas de disco.
+
+    Si el archivo esta en un sistema de solo lectura (o no admite WAL) se
+    sigue con la configuracion por defecto.
+    """
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-20000")
+    except sqlite3.OperationalError as e:
+        logger.warning("[SQLite] No se pudieron aplicar los PRAGMAs: %s", e)
+
+
+# -- Sentencias SQL de uso frecuente --
+
+# sqlite3 cachea las sentencias ya preparadas por texto SQL en cada conexion
+# (cached_statements); con las consultas en constantes, cada llamada reutiliza
+# la misma sentencia preparada en lugar de volver a compilarla
+SQLITE_CACHED_STATEMENTS = 256
+
+INSERT_MESSAGE_SQL = "INSERT INTO messages (session_id, message_json) VALUES (?, ?)"
+
+# Lotes grandes: un solo INSERT ... SELECT que recorre el array con json_each
+BULK_INSERT_MESSAGES_SQL = """
+    INSERT INTO messages (session_id, message_json)
+    SELECT json_extract(value, '$[0]'), CAST(json_extract(value, '$[1]') AS BLOB)
+    FROM json_each(?) ORDER BY key
+"""
+
+# Mensajes nuevos de la sesion en un unico array JSON, mas el ultimo id.
+# Desde SQLite 3.44 el agregado acepta ORDER BY. En versiones anteriores el
+# orden sale del ORDER BY de la subconsulta, algo que SQLite respeta en la
+# practica pero no garantiza (depende del planificador); por eso esa variante
+# devuelve tambien los ids y messages los verifica (ver _in_id_order).
+if sqlite3.sqlite_version_info >= (3, 44):
+    SELECT_NEW_MESSAGES_SQL = """
+        SELECT json_group_array(json(CAST(message_json AS TEXT)) ORDER BY id), MAX(id), NULL
+        FROM messages
+        WHERE session_id = ? AND id > ?
+    """
+else:
+    SELECT_NEW_MESSAGES_SQL = """
+        SELECT json_group_array(json(CAST(message_json AS TEXT))), MAX(id),
+               json_group_array(id)
+        FROM (
+            SELECT id, message_json FROM messages
+            WHERE session_id = ? AND id > ?
+            ORDER BY id
+        )
+    """
+
+DELETE_SESSION_SQL = "DELETE FROM messages WHERE session_id = ?"
+
+SESSION_STATS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM messages WHERE session_id = :sid),
+        (SELECT COUNT(DISTINCT session_id) FROM messages),
+        (SELECT COALESCE(SUM(LENGTH(message_json)), 0)
+         FROM messages WHERE session_id = :sid)
+"""
+
+
+def _connect(db_path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    """Abre una conexion en modo autocommit con cache de sentencias ampliado.
+
+    Con isolation_level=None el modulo sqlite3 no abre transacciones
+    implicitas: cada sentencia se confirma sola y las escrituras en lote
+    usan un BEGIN explicito.
+    """
+    conn = sqlite3.connect(
+        db_path,
+        isolation_level=None,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+        check_same_thread=check_same_thread,
+    )
+    _configure_pragmas(conn)
+    return conn
+
+
+# Marca que detiene al StorageWorker (despues de escribir lo pendiente)
+_STOP = object()
+
+# Workers en ejecucion. Los historiales de get_history normalmente no se
+# cierran, asi que al salir del proceso se detienen aqui: el hilo es daemon
+# y sin esto los mensajes que queden en la cola se perderian
+_LIVE_WORKERS: set["StorageWorker"] = set()
+
+
+@atexit.register
+def _stop_live_workers() -> None:
+    for worker in list(_LIVE_WORKERS):
+        try:
+            worker.stop()
+        except BaseException:
+            logger.exception("[SQLite] Error escribiendo mensajes pendientes al salir")
+
+
+class StorageWorker(threading.Thread):
+    """Hilo que escribe los mensajes en SQLite fuera del hilo del chat.
+
+    add_messages solo encola las filas; este hilo las toma de la cola, junta
+    todo lo que haya pendiente en un lote y lo escribe en una transaccion con
+    su propia conexion. Asi la respuesta al usuario no espera el commit, y
+    si llegan varios lotes seguidos se escriben juntos.
+
+    flush() espera a que todo lo encolado hasta ese momento este escrito;
+    se usa antes de leer (read-after-write) y al cerrar. Si un lote no se
+    pudo escribir, flush() (o stop()) relanza el error en el hilo que
+    llama, para que la perdida de mensajes no pase desapercibida.
+    """
+
+    def __init__(self, db_path: str, bulk_insert_threshold: int) -> None:
+        super().__init__(name="sqlite-storage-worker", daemon=True)
+        self.db_path = db_path
+        self.bulk_insert_threshold = bulk_insert_threshold
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        # Primer error de escritura aun no informado a quien llama
+        self._error: BaseException | None = None
+        _LIVE_WORKERS.add(self)
+
+    def submit(self, rows: list[tuple[str, bytes]]) -> None:
+        """Encola filas (session_id, message_json) para escribirlas."""
+        self._queue.put(rows)
+
+    def flush(self) -> None:
+        """Bloquea hasta que todo lo encolado antes de esta llamada este escrito."""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+        self._raise_pending_error()
+
+    def stop(self) -> None:
+        """Escribe lo pendiente y termina el hilo."""
+        _LIVE_WORKERS.discard(self)
+        self._queue.put(_STOP)
+        self.join()
+        self._raise_pending_error()
+
+    def _raise_pending_error(self) -> None:
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def run(self) -> None:
+        # La conexion se abre con el primer lote, dentro del try: si fallara
+        # fuera de el, el hilo moriria sin liberar a los flush() pendientes
+        conn: sqlite3.Connection | None = None
+        stopping = False
+        while not stopping:
+            # Esperar el primer elemento y juntar todo lo que ya este encolado
+            item = self._queue.get()
+            batch: list[tuple[str, bytes]] = []
+            waiters: list[threading.Event] = []
+            while True:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.extend(item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    if conn is None:
+                        conn = _connect(self.db_path)
+                    self._write(conn, batch)
+                except BaseException as e:
+                    # Cualquier error (no solo sqlite3.Error): si el hilo
+                    # muriera, los flush() siguientes esperarian para siempre
+                    logger.exception("[SQLite] Error guardando %d mensaje(s)", len(batch))
+                    if self._error is None:
+                        self._error = e
+            for done in waiters:
+                done.set()
+        if conn is not None:
+            conn.close()
+
+    def _write(self, conn: sqlite3.Connection, rows: list[tuple[str, bytes]]) -> None:
+        """Escribe un lote de filas en una sola transaccion.
+
+        BEGIN IMMEDIATE toma el lock de escritura desde el inicio, sin tener
+        que promoverlo de lectura a escritura a mitad de la transaccion.
+        """
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if len(rows) > self.bulk_insert_threshold:
+                # Lotes grandes: un solo INSERT ... SELECT que recorre el array
+                # con json_each, en vez de ejecutar el INSERT una vez por fila.
+                # orjson.Fragment inserta el JSON ya codificado sin volver a
+                # procesarlo, y ORDER BY key conserva el orden (y los ids)
+                payload = orjson.dumps(
+                    [[session_id, orjson.Fragment(blob)] for session_id, blob in rows]
+                )
+                conn.execute(BULK_INSERT_MESSAGES_SQL, (payload.decode(),))
+            else:
+                conn.executemany(INSERT_MESSAGE_SQL, rows)
+        logger.info("[SQLite] %d mensaje(s) guardados", len(rows))
+
+
+# -- Serializacion de mensajes --
+
+# Tipos que se (de)serializan directo, sin pasar por message_to_dict /
+# messages_from_dict (model_dump y validacion de pydantic por mensaje).
+# El formato guardado es el mismo: {"type": ..., "data": {...}}
+_MESSAGE_CLASSES: dict[str, type[BaseMessage]] = {
+    "human": HumanMessage,
+    "ai": AIMessage,
+    "system": SystemMessage,
+}
+_MESSAGE_FIELDS = ("content", "additional_kwargs", "response_metadata", "name", "id")
+
+
+def _dump_message(msg: BaseMessage) -> bytes:
+    """Serializa un mensaje al JSON que se guarda en message_json."""
+    msg_class = type(msg)
+    if msg_class is HumanMessage or msg_class is SystemMessage:
+        data = {field: getattr(msg, field) for field in _MESSAGE_FIELDS}
+    elif msg_class is AIMessage and not msg.tool_calls and not msg.invalid_tool_calls:
+        data = {field: getattr(msg, field) for field in _MESSAGE_FIELDS}
+        data["usage_metadata"] = msg.usage_metadata
+    else:
+        # Tool calls, ToolMessage, subclases, etc.: formato completo de LangChain
+        return orjson.dumps(message_to_dict(msg))
+    return orjson.dumps({"type": msg.type, "data": data})
+
+
+def _load_messages(items: list[dict]) -> list[BaseMessage]:
+    """Reconstruye los mensajes guardados por _dump_message.
+
+    Los datos los escribio este mismo modulo, asi que los tipos conocidos
+    se construyen con model_construct, sin validar cada campo. El resto
+    pasa por messages_from_dict.
+    """
+    messages = []
+    for item in items:
+        msg_class = _MESSAGE_CLASSES.get(item["type"])
+        if msg_class is None:
+            messages.extend(messages_from_dict([item]))
+        else:
+            messages.append(msg_class.model_construct(**item["data"]))
+    return messages
+
+
+def _in_id_order(items: list[dict], ids_json: str | None) -> list[dict]:
+    """Ordena por id los mensajes agregados sin ORDER BY (SQLite < 3.44).
+
+    ids_json es el array de ids en el mismo orden que items, o None si la
+    consulta ya ordeno el agregado. Si ya vienen ordenados (lo habitual),
+    se devuelven tal cual.
+    """
+    if ids_json is None:
+        return items
+    ids = orjson.loads(ids_json)
+    if all(a < b for a, b in itertools.pairwise(ids)):
+        return items
+    logger.warning("[SQLite] json_group_array no respeto el orden por id, reordenando")
+    return [item for _, item in sorted(zip(ids, items), key=lambda pair: pair[0])]
+
+
+# Historiales abiertos por (db_path, session_id). RunnableWithMessageHistory
+# pide el historial en cada invoke; asi se reutiliza la misma conexion en
+# lugar de abrir una nueva por turno
+_HISTORIES: dict[tuple[str, str], "SQLiteChatHistory"] = {}
+
+
+def get_history(session_id: str, db_path: str) -> "SQLiteChatHistory":
+    """Devuelve el historial abierto de la sesion, creandolo si no existe."""
+    key = (db_path, session_id)
+    history = _HISTORIES.get(key)
+    if history is None:
+        history = _HISTORIES[key] = SQLiteChatHistory(session_id=session_id, db_path=db_path)
+    return history
+
+
 class SQLiteChatHistory(BaseChatMessageHistory):
     """Historial de mensajes de chat respaldado por SQLite.
 
@@ -95,29 +446,23 @@ class SQLiteChatHistory(BaseChatMessageHistory):
     adaptado a la interfaz BaseChatMessageHistory de LangChain.
     """
 
+    # A partir de cuantos mensajes add_messages inserta con json_each
+    BULK_INSERT_THRESHOLD = 8
+
     def __init__(self, session_id: str, db_path: str) -> None:
         self.session_id = session_id
         self.db_path = db_path
         # check_same_thread=False es necesario porque RunnableWithMessageHistory
         # puede invocar la lectura del historial desde un thread distinto al que
         # creo la conexion. En produccion se usaria un pool de conexiones.
-        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self._conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                message_json TEXT NOT NULL
-            )
-            """
-        )
-        self._conn.execute(
-            """
-            CREATE INDEX IF NOT EXISTS idx_messages_session
-            ON messages (session_id)
-            """
-        )
-        self._conn.commit()
+        self._conn = _connect(self.db_path, check_same_thread=False)
+        _ensure_schema(self.db_path)
+        self._writer = StorageWorker(self.db_path, self.BULK_INSERT_THRESHOLD)
+        self._writer.start()
+        # Mensajes ya leidos de SQLite y el id de la ultima fila leida: cada
+        # lectura solo trae las filas nuevas (id > _last_id)
+        self._cache: list[BaseMessage] = []
+        self._last_id = 0
         logger.info(
             "[SQLite] Conexion abierta a '%s' (session: %s)",
             self.db_path,
@@ -126,65 +471,75 @@ class SQLiteChatHistory(BaseChatMessageHistory):
 
     @property
     def messages(self) -> list[BaseMessage]:
-        """Recupera todos los mensajes de esta sesion desde SQLite."""
-        cursor = self._conn.execute(
-            "SELECT message_json FROM messages WHERE session_id = ? ORDER BY id",
-            (self.session_id,),
-        )
-        rows = cursor.fetchall()
-        if not rows:
-            return []
-        items = [json.loads(row[0]) for row in rows]
-        return messages_from_dict(items)
+        """Recupera todos los mensajes de esta sesion.
+
+        Los mensajes ya leidos se guardan en memoria; a SQLite solo se le
+        piden las filas con id mayor al ultimo leido. SQLite arma un unico
+        array JSON con esas filas (en orden de insercion) y Python lo
+        decodifica de una vez, en lugar de traer una fila por mensaje y
+        llamar a orjson.loads por cada una.
+        """
+        # Los mensajes encolados deben estar escritos antes de leer
+        self._writer.flush()
+        array_json, max_id, ids_json = self._conn.execute(
+            SELECT_NEW_MESSAGES_SQL, (self.session_id, self._last_id)
+        ).fetchone()
+        if max_id is not None:
+            items = _in_id_order(orjson.loads(array_json), ids_json)
+            self._cache.extend(_load_messages(items))
+            self._last_id = max_id
+        # Copia: quien la reciba puede modificarla sin tocar el cache
+        return list(self._cache)
 
     def add_messages(self, messages: list[BaseMessage]) -> None:
-        """Guarda una lista de mensajes en la base de datos SQLite."""
-        self._conn.executemany(
-            "INSERT INTO messages (session_id, message_json) VALUES (?, ?)",
-            [
-                (self.session_id, json.dumps(message_to_dict(msg)))
-                for msg in messages
-            ],
-        )
-        self._conn.commit()
+        """Encola una lista de mensajes para guardarlos en SQLite.
+
+        RunnableWithMessageHistory llama a este metodo una vez por turno con
+        el mensaje del usuario y la respuesta juntos. La escritura la hace el
+        StorageWorker en segundo plano, asi que el turno no espera el commit.
+        """
+        # orjson devuelve bytes (JSON compacto en UTF-8) que se guardan tal
+        # cual como BLOB, sin pasar por str
+        self._writer.submit([(self.session_id, _dump_message(msg)) for msg in messages])
         logger.info(
-            "[SQLite] %d mensaje(s) guardados en session '%s'",
+            "[SQLite] %d mensaje(s) encolados en session '%s'",
             len(messages),
             self.session_id,
         )
 
+    def flush(self) -> None:
+        """Espera a que los mensajes encolados esten escritos en SQLite."""
+        self._writer.flush()
+
     def clear(self) -> None:
         """Elimina todos los mensajes de esta sesion."""
-        self._conn.execute(
-            "DELETE FROM messages WHERE session_id = ?",
-            (self.session_id,),
-        )
-        self._conn.commit()
+        # Si no, un lote encolado antes del clear se escribiria despues
+        self._writer.flush()
+        # Autocommit: el DELETE se confirma al ejecutarse
+        self._conn.execute(DELETE_SESSION_SQL, (self.session_id,))
+        self._cache.clear()
+        self._last_id = 0
         logger.info("[SQLite] Historial limpiado para session '%s'", self.session_id)
 
     def close(self) -> None:
         """Cierra la conexion a SQLite."""
-        self._conn.close()
-        logger.info("[SQLite] Conexion cerrada")
+        # Sacarlo del cache: la proxima get_history abre una conexion nueva
+        if _HISTORIES.get((self.db_path, self.session_id)) is self:
+            del _HISTORIES[(self.db_path, self.session_id)]
+        # Escribir lo pendiente antes de cerrar
+        try:
+            self._writer.stop()
+        finally:
+            self._conn.close()
+            logger.info("[SQLite] Conexion cerrada")
 
     def get_session_stats(self) -> dict:
         """Devuelve estadisticas de la sesion actual."""
-        cursor = self._conn.execute(
-            "SELECT COUNT(*) FROM messages WHERE session_id = ?",
-            (self.session_id,),
-        )
-        msg_count = cursor.fetchone()[0]
-
-        cursor = self._conn.execute(
-            "SELECT COUNT(DISTINCT session_id) FROM messages",
-        )
-        total_sessions = cursor.fetchone()[0]
-
-        cursor = self._conn.execute(
-            "SELECT SUM(LENGTH(message_json)) FROM messages WHERE session_id = ?",
-            (self.session_id,),
-        )
-        total_bytes = cursor.fetchone()[0] or 0
+        self._writer.flush()
+        # Los tres agregados en una sola consulta
+        msg_count, total_sessions, total_bytes = self._conn.execute(
+            SESSION_STATS_SQL, {"sid": self.session_id}
+        ).fetchone()
 
         return {
             "session_id": self.session_id,
@@ -209,31 +564,41 @@ def create_chain(llm: ChatOpenAI):
     return prompt | llm | StrOutputParser()
 
 
+# Maximo de mensajes que inspect_db muestra de la ultima sesion
+INSPECT_MESSAGE_LIMIT = 100
+
+
 def inspect_db(db_path: str) -> None:
-    """Muestra el contenido de la base de datos SQLite para inspeccion."""
+    """Muestra el contenido de la base de datos SQLite para inspeccion.
+
+    Recorre los cursores fila por fila (sin fetchall), asi que no carga
+    en memoria todas las sesiones ni todos los mensajes a la vez.
+    """
     conn = sqlite3.connect(db_path)
     cursor = conn.execute(
         "SELECT session_id, COUNT(*) as msg_count "
         "FROM messages GROUP BY session_id ORDER BY session_id"
     )
-    sessions = cursor.fetchall()
     print("\n    --- Contenido de la base de datos SQLite ---")
     print(f"    Archivo: {db_path}")
-    print(f"    Sesiones encontradas: {len(sessions)}")
-    for sid, count in sessions:
+    session_count = 0
+    last_sid = None
+    for sid, count in cursor:
         print(f"      Session {sid[:8]}...: {count} mensajes")
+        session_count += 1
+        last_sid = sid
+    print(f"    Sesiones encontradas: {session_count}")
 
     # Mostrar los mensajes de la ultima sesion
-    if sessions:
-        last_sid = sessions[-1][0]
+    if last_sid is not None:
         cursor = conn.execute(
             "SELECT id, message_json FROM messages "
-            "WHERE session_id = ? ORDER BY id",
-            (last_sid,),
+            "WHERE session_id = ? ORDER BY id LIMIT ?",
+            (last_sid, INSPECT_MESSAGE_LIMIT),
         )
-        print(f"\n    Mensajes de la sesion {last_sid[:8]}...:")
-        for row_id, msg_json in cursor.fetchall():
-            data = json.loads(msg_json)
+        print(f"\n    Mensajes de la sesion {last_sid[:8]}... (maximo {INSPECT_MESSAGE_LIMIT}):")
+        for row_id, msg_json in cursor:
+            data = orjson.loads(msg_json)
             msg_type = data.get("type", "desconocido")
             content = data.get("data", {}).get("content", "")
             preview = content[:80] + "..." if len(content) > 80 else content
@@ -250,6 +615,10 @@ def main() -> None:
     db_path = "sqlite-history/chat_history.sqlite3"
     session_id = str(uuid.uuid4())
 
+    # Cache exacta de respuestas del LLM: un prompt identico (mismo
+    # historial + misma pregunta) no vuelve a llamar a la API
+    set_llm_cache(SQLiteCache(database_path=LLM_CACHE_PATH))
+
     llm = ChatOpenAI(
         api_key=OPENAI_API_KEY,
         model=LLM_MODEL,
@@ -269,13 +638,14 @@ def main() -> None:
     print("\n=== Sesion persistente en SQLite ===")
     print("--- Fase 1: Iniciando conversacion ---\n")
 
-    history1 = SQLiteChatHistory(session_id=session_id, db_path=db_path)
+    history1 = get_history(session_id, db_path)
 
     # Funcion para obtener el historial por session_id
-    # RunnableWithMessageHistory la llama internamente
+    # RunnableWithMessageHistory la llama internamente en cada invoke;
+    # get_history devuelve siempre la misma instancia (history1)
     chain_with_history = RunnableWithMessageHistory(
         chain,
-        lambda sid: SQLiteChatHistory(session_id=sid, db_path=db_path),
+        lambda sid: get_history(sid, db_path),
         input_messages_key="question",
         history_messages_key="history",
     )
@@ -317,9 +687,10 @@ def main() -> None:
 
     # Crear una nueva instancia del historial y del agente
     # (como si la aplicacion se hubiera reiniciado)
+    # history1.close() la quito del cache, asi que get_history abre una nueva
     chain_with_history2 = RunnableWithMessageHistory(
         chain,
-        lambda sid: SQLiteChatHistory(session_id=sid, db_path=db_path),
+        lambda sid: get_history(sid, db_path),
         input_messages_key="question",
         history_messages_key="history",
     )
@@ -346,7 +717,7 @@ def main() -> None:
     print(f"[Agente]:  {response4}\n")
 
     # Mostrar estadisticas finales
-    history_final = SQLiteChatHistory(session_id=session_id, db_path=db_path)
+    history_final = get_history(session_id, db_path)
     stats = history_final.get_session_stats()
     print(f"    Mensajes totales en la sesion: {stats['message_count']}")
     print(f"    Sesiones en la BD: {stats['total_sessions_in_db']}")
@@ -46,6 +46,7 @@ from langchain_core.chat_history import InMemoryChatMessageHistory
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import Runnable
 from langchain_openai import ChatOpenAI
 
 # -- Logging --
@@ -69,15 +70,17 @@ LLM_TEMPERATURE = float(os.getenv("DEFAULT_LLM_TEMPERATURE", "0.7"))
 # -- Herramientas simuladas (datos ficticios) --
 
 
+_WEATHER_CONDITIONS = ("soleado", "nublado", "lluvioso", "parcialmente nublado", "tormentoso")
+
+
 def get_weather(city: str) -> str:
     """Devuelve datos del clima simulados para una ciudad."""
-    conditions = ["soleado", "nublado", "lluvioso", "parcialmente nublado", "tormentoso"]
-    temp = random.randint(5, 35)
-    condition = random.choice(conditions)
+    # randrange evita la validacion extra de randint (mismos rangos, extremo incluido)
     return (
-        f"Clima en {city}: {condition}, {temp} C. "
-        f"Humedad: {random.randint(30, 90)}%. "
-        f"Viento: {random.randint(5, 30)} km/h."
+        f"Clima en {city}: {random.choice(_WEATHER_CONDITIONS)}, "
+        f"{random.randrange(5, 36)} C. "
+        f"Humedad: {random.randrange(30, 91)}%. "
+        f"Viento: {random.randrange(5, 31)} km/h."
     )
 
 
@@ -115,21 +118,49 @@ def get_activities(city: str) -> str:
 _encoding = tiktoken.encoding_for_model(LLM_MODEL)
 
 
-def count_tokens(text: str) -> int:
-    """Cuenta los tokens de un texto usando tiktoken."""
-    return len(_encoding.encode(text))
+# Tokens por contenido de mensaje. El contenido no cambia una vez en el
+# historial y el historial se vuelve a contar en cada turno, asi que solo
+# se tokeniza el contenido nuevo
+_token_counts: dict[str, int] = {}
+_TOKEN_CACHE_SIZE = 4096
+# A partir de cuantos textos sin cache conviene encode_batch: crea un pool
+# de hilos en cada llamada, que con 1-2 textos cuesta mas que encode
+ENCODE_BATCH_MIN = 8
+
+
+def _cache_token_counts(texts: list[str], counts: list[int]) -> None:
+    if len(_token_counts) + len(texts) > _TOKEN_CACHE_SIZE:
+        _token_counts.clear()
+    _token_counts.update(zip(texts, counts))
 
 
 def count_message_tokens(messages: list) -> int:
-    """Cuenta el total de tokens en una lista de mensajes de LangChain."""
-    total = 0
-    for msg in messages:
-        # Overhead por mensaje (rol + delimitadores)
-        total += 4
-        total += count_tokens(msg.content)
-    # Overhead final
-    total += 2
-    return total
+    """Cuenta el total de tokens en una lista de mensajes de LangChain.
+
+    Solo se tokenizan los contenidos que no estan en cache. En un turno
+    normal son 1-2 mensajes y se usa encode; si faltan muchos (por ejemplo
+    al contar un historial completo por primera vez) se usa encode_batch,
+    que reparte el trabajo en hilos de tiktoken (Rust, sin el GIL).
+    """
+    contents = [msg.content for msg in messages]
+    counts = {}
+    misses = []
+    for text in dict.fromkeys(contents):
+        count = _token_counts.get(text)
+        if count is None:
+            misses.append(text)
+        else:
+            counts[text] = count
+    if misses:
+        if len(misses) >= ENCODE_BATCH_MIN:
+            encoded = _encoding.encode_batch(misses, num_threads=os.cpu_count() or 1)
+        else:
+            encoded = [_encoding.encode(text) for text in misses]
+        miss_counts = [len(tokens) for tokens in encoded]
+        counts.update(zip(misses, miss_counts))
+        _cache_token_counts(misses, miss_counts)
+    # Overhead por mensaje (rol + delimitadores) y overhead final
+    return sum(counts[text] for text in contents) + 4 * len(messages) + 2
 
 
 # -- Resumen de conversacion --
@@ -143,11 +174,29 @@ SUMMARIZE_PROMPT = (
 )
 
 
+def build_summary_chain(llm: ChatOpenAI) -> Runnable:
+    """Construye la cadena de resumen (prompt | llm | parser).
+
+    Se construye una sola vez por SummarizingChat y se reutiliza en cada
+    resumen, en lugar de recrear el prompt y la cadena en cada llamada.
+    """
+    return (
+        ChatPromptTemplate.from_messages(
+            [
+                ("system", SUMMARIZE_PROMPT),
+                ("human", "Resume esta conversacion:\n\n{conversation}"),
+            ]
+        )
+        | llm
+        | StrOutputParser()
+    )
+
+
 def summarize_history(
-    llm: ChatOpenAI,
+    summary_chain: Runnable,
     messages: list,
 ) -> str:
-    """Llama al LLM para resumir los mensajes de la conversacion."""
+    """Llama a la cadena de resumen con los mensajes de la conversacion."""
     conversation_lines = []
     for msg in messages:
         role = "usuario" if isinstance(msg, HumanMessage) else "asistente"
@@ -157,17 +206,6 @@ def summarize_history(
 
     conversation_text = "\n".join(conversation_lines)
 
-    summary_chain = (
-        ChatPromptTemplate.from_messages(
-            [
-                ("system", SUMMARIZE_PROMPT),
-                ("human", "Resume esta conversacion:\n\n{conversation}"),
-            ]
-        )
-        | llm
-        | StrOutputParser()
-    )
-
     return summary_chain.invoke({"conversation": conversation_text})
 
 
@@ -177,10 +215,17 @@ def summarize_history(
 class SummarizingChat:
     """Maneja una conversacion multi-turno con resumen automatico.
 
-    Cuando el uso acumulado de tokens supera un umbral configurable,
-    la conversacion anterior se resume y se reemplaza por un unico
-    mensaje de resumen. Esto mantiene manejable la ventana de contexto
-    en conversaciones largas.
+    Cuando el uso acumulado de tokens supera un umbral configurable, la
+    conversacion se resume para mantener manejable la ventana de contexto
+    en conversaciones largas. Hay dos niveles:
+
+    - token_threshold (suave): se resumen los mensajes posteriores al
+      prefijo (los primeros `prefix_messages` del historial). El prefijo
+      no cambia, asi que el inicio del prompt (system + prefijo) sigue
+      siendo identico entre llamadas y aprovecha el prompt caching de
+      OpenAI, que reutiliza el prefijo comun de prompts recientes.
+    - hard_token_threshold (duro): si aun asi el contexto crece demasiado,
+      se resume todo, prefijo incluido, en un unico mensaje.
 
     Equivale al SummarizationMiddleware de Azure Agent Framework,
     adaptado al patron de LangChain con ChatMessageHistory y callbacks.
@@ -191,10 +236,14 @@ class SummarizingChat:
         llm: ChatOpenAI,
         system_prompt: str,
         token_threshold: int = 1000,
+        hard_token_threshold: int | None = None,
+        prefix_messages: int = 2,
     ) -> None:
         self.llm = llm
         self.system_prompt = system_prompt
         self.token_threshold = token_threshold
+        self.hard_token_threshold = hard_token_threshold or 4 * token_threshold
+        self.prefix_messages = prefix_messages
         self.context_tokens = 0
         self.history = InMemoryChatMessageHistory()
         self.chain = (
@@ -208,37 +257,62 @@ class SummarizingChat:
             | llm
             | StrOutputParser()
         )
+        self._summary_chain = build_summary_chain(llm)
+
+    def _summarize_into(self, prefix: list, to_summarize: list) -> None:
+        """Reemplaza el historial por `prefix` + un mensaje con el resumen."""
+        summary_text = summarize_history(self._summary_chain, to_summarize)
+        logger.info(
+            "[Resumen] Resumen generado: %s",
+            summary_text[:200] + "..." if len(summary_text) > 200 else summary_text,
+        )
+
+        self.history.clear()
+        self.history.add_messages(
+            [
+                *prefix,
+                AIMessage(
+                    content=f"[Resumen de la conversacion anterior]\n{summary_text}"
+                ),
+            ]
+        )
+
+        # Reiniciar contador de tokens
+        self.context_tokens = count_message_tokens(self.history.messages)
 
     def _check_and_summarize(self) -> None:
-        """Revisa el uso de tokens y resume si supera el umbral."""
+        """Revisa el uso de tokens y resume si supera algun umbral."""
         messages = self.history.messages
 
-        if self.context_tokens > self.token_threshold and len(messages) > 2:
+        if self.context_tokens > self.hard_token_threshold and len(messages) > 2:
             logger.info(
-                "[Resumen] Uso de tokens (%d) excede el umbral (%d). "
-                "Resumiendo %d mensajes del historial...",
+                "[Resumen] Uso de tokens (%d) excede el umbral duro (%d). "
+                "Resumiendo los %d mensajes del historial...",
                 self.context_tokens,
-                self.token_threshold,
+                self.hard_token_threshold,
                 len(messages),
             )
-
-            summary_text = summarize_history(self.llm, messages)
+            self._summarize_into([], messages)
+            logger.info("[Resumen] Historial compactado a 1 mensaje de resumen")
+        elif (
+            self.context_tokens > self.token_threshold
+            and len(messages) > self.prefix_messages + 2
+        ):
+            prefix = messages[: self.prefix_messages]
+            rest = messages[self.prefix_messages :]
             logger.info(
-                "[Resumen] Resumen generado: %s",
-                summary_text[:200] + "..." if len(summary_text) > 200 else summary_text,
+                "[Resumen] Uso de tokens (%d) excede el umbral (%d). "
+                "Resumiendo %d mensajes; se conservan los %d del prefijo...",
+                self.context_tokens,
+                self.token_threshold,
+                len(rest),
+                len(prefix),
             )
-
-            # Reemplazar historial con un unico mensaje de resumen
-            self.history.clear()
-            self.history.add_message(
-                AIMessage(
-                    content=f"[Resumen de la conversacion anterior]\n{summary_text}"
-                )
+            self._summarize_into(prefix, rest)
+            logger.info(
+                "[Resumen] Historial compactado a %d mensaje(s) de prefijo + 1 de resumen",
+                len(prefix),
             )
-
-            # Reiniciar contador de tokens
-            self.context_tokens = count_message_tokens(self.history.messages)
-            logger.info("[Resumen] Historial compactado a 1 mensaje de resumen")
         else:
             logger.info(
                 "[Resumen] Uso de tokens: %d / %d umbral. No hace falta resumir.",
@@ -297,7 +371,9 @@ def main() -> None:
     )
 
     # Usar un umbral bajo para que el resumen se dispare rapido en la demo
-    chat = SummarizingChat(llm=llm, system_prompt=system_prompt, token_threshold=500)
+    chat = SummarizingChat(
+        llm=llm, system_prompt=system_prompt, token_threshold=500, hard_token_threshold=4000
+    )
 
     # Simulacion de conversacion multi-turno
     conversations = [
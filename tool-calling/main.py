@@ -26,16 +26,19 @@ Basado en agent_tools.py del repositorio Azure Agent Framework Demos,
 adaptado para usar LangChain con bind_tools().
 """
 
-import json
 import logging
 import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import orjson
 from dotenv import load_dotenv
+from langchain_community.cache import RedisSemanticCache, SQLiteCache
+from langchain_core.globals import set_llm_cache
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
 # -- Configuracion --
 
@@ -45,6 +48,13 @@ logger.setLevel(logging.INFO)
 
 load_dotenv(override=True)
 
+# Cache de respuestas del LLM: exacta en SQLite por defecto, o semantica en
+# Redis si LLM_SEMANTIC_CACHE=1 (reutiliza respuestas de prompts parecidos)
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "tool-calling/llm_cache.sqlite3")
+LLM_SEMANTIC_CACHE = os.getenv("LLM_SEMANTIC_CACHE", "0") == "1"
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+SEMANTIC_CACHE_THRESHOLD = 0.2
+
 
 # -- Herramientas --
 
@@ -86,12 +96,22 @@ tools = [get_current_date, get_weather, get_activities]
 tool_map = {t.name: t for t in tools}
 
 
+def _invoke_tool(tc: dict) -> ToolMessage:
+    """Ejecuta una tool_call y envuelve el resultado en un ToolMessage."""
+    result = tool_map[tc["name"]].invoke(tc["args"])
+    if not isinstance(result, str):
+        result = orjson.dumps(result).decode()
+    return ToolMessage(content=result, tool_call_id=tc["id"])
+
+
 def run(llm_with_tools, messages: list) -> str:
     """Ejecuta el bucle de tool calling hasta obtener una respuesta final.
 
-    Envia los mensajes al LLM; si responde con tool_calls, ejecuta cada
-    herramienta, agrega los resultados y vuelve a invocar al LLM. Repite
-    hasta que el LLM responda sin tool_calls.
+    Envia los mensajes al LLM; si responde con tool_calls, ejecuta las
+    herramientas en paralelo (son independientes entre si, asi que la
+    latencia es la de la mas lenta y no la suma), agrega los resultados
+    en el orden original y vuelve a invocar al LLM. Repite hasta que el
+    LLM responda sin tool_calls.
     """
     while True:
         response: AIMessage = llm_with_tools.invoke(messages)
@@ -100,17 +120,45 @@ def run(llm_with_tools, messages: list) -> str:
         if not response.tool_calls:
             return response.content
 
-        for tc in response.tool_calls:
-            result = tool_map[tc["name"]].invoke(tc["args"])
-            if not isinstance(result, str):
-                result = json.dumps(result, ensure_ascii=False)
-            messages.append(ToolMessage(content=result, tool_call_id=tc["id"]))
+        if len(response.tool_calls) == 1:
+            messages.append(_invoke_tool(response.tool_calls[0]))
+            continue
+
+        with ThreadPoolExecutor(max_workers=len(response.tool_calls)) as executor:
+            messages.extend(executor.map(_invoke_tool, response.tool_calls))
+
+
+# -- Cache del LLM --
+
+
+def configure_llm_cache() -> None:
+    """Activa la cache global de LangChain para las llamadas al LLM.
+
+    Con la cache exacta (SQLiteCache), volver a ejecutar la demo con los
+    mismos mensajes no vuelve a llamar a la API. La cache semantica
+    (RedisSemanticCache) tambien acierta con prompts parecidos, cuya
+    distancia coseno de embeddings sea menor a SEMANTIC_CACHE_THRESHOLD.
+    """
+    if LLM_SEMANTIC_CACHE:
+        set_llm_cache(
+            RedisSemanticCache(
+                redis_url=REDIS_URL,
+                embedding=OpenAIEmbeddings(model="text-embedding-3-small"),
+                score_threshold=SEMANTIC_CACHE_THRESHOLD,
+            )
+        )
+        logger.info("[Cache] Cache semantica del LLM en %s", REDIS_URL)
+    else:
+        set_llm_cache(SQLiteCache(database_path=LLM_CACHE_PATH))
+        logger.info("[Cache] Cache exacta del LLM en %s", LLM_CACHE_PATH)
 
 
 # -- Punto de entrada --
 
 
 def main() -> None:
+    configure_llm_cache()
+
     llm = ChatOpenAI(
         model=os.getenv("DEFAULT_LLM_MODEL", "gpt-4o-mini"),
         temperature=float(os.getenv("DEFAULT_LLM_TEMPERATURE", "0.7")),